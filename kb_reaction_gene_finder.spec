@@ -14,6 +14,11 @@ module kb_reaction_gene_finder {
     */
     typedef string obj_ref;
 
+    /* A boolean - 0 for false, 1 for true.
+        @range (0, 1)
+    */
+    typedef int boolean;
+
     typedef structure {
         string workspace_name;
         string bulk_reaction_ids;
@@ -24,6 +29,11 @@ module kb_reaction_gene_finder {
         float blast_score_floor;
         int number_of_hits_to_report;
         string feature_set_prefix;
+        boolean batch_blast;
+        int max_workers;
+        int kmer_min_shared;
+        boolean kmer_recall_check;
+        boolean memory_profile;
     } findGenesParams;
 
 	/*
@@ -61,12 +71,33 @@ module kb_reaction_gene_finder {
     } GeneHits;
 
 
+    /* Seconds spent in each stage and counts for one reaction searched in this run */
+    typedef structure {
+        string reaction_id;
+        mapping<string, float> stage_seconds;
+        mapping<string, int> counts;
+    } reactionTimings;
+
+    /* Seconds spent in each stage of a run, the number of times each ran and counts such as
+       the RE genes returned, missing genes, alignment rows and rows above the score floor
+    */
+    typedef structure {
+        mapping<string, float> stage_seconds;
+        mapping<string, int> stage_calls;
+        mapping<string, int> counts;
+        list<reactionTimings> reactions;
+    } runTimings;
+
+    /*
+        @optional timings
+    */
     typedef structure {
 
         list <GeneHits> gene_hits;
         list<obj_ref> feature_set_refs;
         string report_name;
         obj_ref report_ref;
+        runTimings timings;
 
     } findGenesResults;
 
@@ -0,0 +1,422 @@
+import abc
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+ALIGNMENT_COLS = ['sseqid', 'qseqid', 'bitscore', 'pident', 'length', 'mismatch', 'evalue']
+
+AMINO_ACIDS = 'ARNDCQEGHILKMFPSTWYVBZX*'
+BLOSUM62 = np.array([
+    [4, -1, -2, -2, 0, -1, -1, 0, -2, -1, -1, -1, -1, -2, -1, 1, 0, -3, -2, 0, -2, -1, 0, -4],
+    [-1, 5, 0, -2, -3, 1, 0, -2, 0, -3, -2, 2, -1, -3, -2, -1, -1, -3, -2, -3, -1, 0, -1, -4],
+    [-2, 0, 6, 1, -3, 0, 0, 0, 1, -3, -3, 0, -2, -3, -2, 1, 0, -4, -2, -3, 3, 0, -1, -4],
+    [-2, -2, 1, 6, -3, 0, 2, -1, -1, -3, -4, -1, -3, -3, -1, 0, -1, -4, -3, -3, 4, 1, -1, -4],
+    [0, -3, -3, -3, 9, -3, -4, -3, -3, -1, -1, -3, -1, -2, -3, -1, -1, -2, -2, -1, -3, -3, -2, -4],
+    [-1, 1, 0, 0, -3, 5, 2, -2, 0, -3, -2, 1, 0, -3, -1, 0, -1, -2, -1, -2, 0, 3, -1, -4],
+    [-1, 0, 0, 2, -4, 2, 5, -2, 0, -3, -3, 1, -2, -3, -1, 0, -1, -3, -2, -2, 1, 4, -1, -4],
+    [0, -2, 0, -1, -3, -2, -2, 6, -2, -4, -4, -2, -3, -3, -2, 0, -2, -2, -3, -3, -1, -2, -1, -4],
+    [-2, 0, 1, -1, -3, 0, 0, -2, 8, -3, -3, -1, -2, -1, -2, -1, -2, -2, 2, -3, 0, 0, -1, -4],
+    [-1, -3, -3, -3, -1, -3, -3, -4, -3, 4, 2, -3, 1, 0, -3, -2, -1, -3, -1, 3, -3, -3, -1, -4],
+    [-1, -2, -3, -4, -1, -2, -3, -4, -3, 2, 4, -2, 2, 0, -3, -2, -1, -2, -1, 1, -4, -3, -1, -4],
+    [-1, 2, 0, -1, -3, 1, 1, -2, -1, -3, -2, 5, -1, -3, -1, 0, -1, -3, -2, -2, 0, 1, -1, -4],
+    [-1, -1, -2, -3, -1, 0, -2, -3, -2, 1, 2, -1, 5, 0, -2, -1, -1, -1, -1, 1, -3, -1, -1, -4],
+    [-2, -3, -3, -3, -2, -3, -3, -3, -1, 0, 0, -3, 0, 6, -4, -2, -2, 1, 3, -1, -3, -3, -1, -4],
+    [-1, -2, -2, -1, -3, -1, -1, -2, -2, -3, -3, -1, -2, -4, 7, -1, -1, -4, -3, -2, -2, -1, -2, -4],
+    [1, -1, 1, 0, -1, 0, 0, 0, -1, -2, -2, 0, -1, -2, -1, 4, 1, -3, -2, -2, 0, 0, 0, -4],
+    [0, -1, 0, -1, -1, -1, -1, -2, -2, -1, -1, -1, -1, -2, -1, 1, 5, -2, -2, 0, -1, -1, 0, -4],
+    [-3, -3, -4, -4, -2, -2, -3, -2, -2, -3, -2, -3, -1, 1, -4, -3, -2, 11, 2, -3, -4, -3, -2, -4],
+    [-2, -2, -2, -3, -2, -1, -2, -3, 2, -1, -1, -2, -1, 3, -3, -2, -2, 2, 7, -1, -3, -2, -1, -4],
+    [0, -3, -3, -3, -1, -2, -2, -3, -3, 3, 1, -2, 1, -1, -2, -2, 0, -3, -1, 4, -3, -2, -1, -4],
+    [-2, -1, 3, 4, -3, 0, 1, -1, 0, -3, -4, 0, -3, -3, -2, 0, -1, -4, -3, -3, 4, 1, -1, -4],
+    [-1, 0, 0, 1, -3, 3, 4, -2, 0, -3, -3, 1, -1, -3, -1, 0, -1, -3, -2, -2, 1, 4, -1, -4],
+    [0, -1, -1, -1, -2, -1, -1, -1, -1, -1, -1, -1, -1, -1, -2, 0, 0, -2, -1, -1, -1, -1, -1, -4],
+    [-4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, 1],
+], dtype=np.int64)
+
+# blastp's defaults for BLOSUM62 and the matching gapped Karlin-Altschul parameters
+GAP_OPEN = 11
+GAP_EXTEND = 1
+LAMBDA = 0.267
+K = 0.041
+MAX_EVALUE = 10
+
+# residue code used between proteins when a genome is searched as one concatenated sequence
+_SEPARATOR = len(AMINO_ACIDS)
+_NEG_INF = -(1 << 40)
+_SEGMENT_PENALTY = 1 << 32
+_SCORES = np.full((len(AMINO_ACIDS) + 1, len(AMINO_ACIDS) + 1), _NEG_INF, dtype=np.int64)
+_SCORES[:-1, :-1] = BLOSUM62
+_CODES = np.full(256, AMINO_ACIDS.index('X'), dtype=np.int64)
+for _code, _aa in enumerate(AMINO_ACIDS):
+    _CODES[ord(_aa)] = _CODES[ord(_aa.lower())] = _code
+
+
+def encode(sequence):
+    """Converts a protein sequence to an array of residue codes for the scoring matrix"""
+    return _CODES[np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def read_fasta(file_path):
+    """Yields (id, sequence) for each record in a FASTA file"""
+    seq_id, lines = None, []
+    with open(file_path) as infile:
+        for line in infile:
+            line = line.strip()
+            if line.startswith('>'):
+                if seq_id is not None:
+                    yield seq_id, "".join(lines)
+                seq_id, lines = line[1:].split(maxsplit=1)[0], []
+            elif line:
+                lines.append(line)
+    if seq_id is not None:
+        yield seq_id, "".join(lines)
+
+
+def write_fasta(sequences, outfile):
+    """Write RE query output to an open file in FASTA format"""
+    if not sequences or not isinstance(sequences, list) or "key" not in sequences[0] \
+            or "sequence" not in sequences[0]:
+        raise ValueError(f"Unexpected input type:{sequences}")
+    for seq in sequences:
+        if seq["sequence"]:
+            outfile.write(f'>{seq["key"]}\n{seq["sequence"]}\n')
+
+
+def _format_evalue(evalue):
+    """Formats an E value the way BLAST's tabular output does"""
+    if evalue < 1e-180:
+        return '0.0'
+    if evalue < 1e-99:
+        return f'{evalue:.0e}'
+    if evalue < 0.0009:
+        return f'{evalue:.2e}'
+    if evalue < 0.1:
+        return f'{evalue:.3f}'
+    if evalue < 1:
+        return f'{evalue:.2f}'
+    if evalue < 10:
+        return f'{evalue:.1f}'
+    return f'{evalue:.0f}'
+
+
+def _format_bitscore(bitscore):
+    """Formats a bit score the way BLAST's tabular output does"""
+    return f'{bitscore:.0f}' if bitscore > 99.9 else f'{bitscore:.1f}'
+
+
+class GenomeProteins:
+    """The IDs and encoded sequences of a genome's proteins, read the first time they're used"""
+    def __init__(self, genome_fasta):
+        self.genome_fasta = genome_fasta
+        self._ids = None
+        self._encoded = None
+        self._length = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Reads the FASTA file, unless it has been read already"""
+        with self._lock:
+            if self._ids is None:
+                ids, encoded = [], []
+                for seq_id, sequence in read_fasta(self.genome_fasta):
+                    ids.append(seq_id)
+                    encoded.append(encode(sequence))
+                self._length = sum(len(protein) for protein in encoded)
+                self._encoded = encoded
+                self._ids = ids
+
+    @property
+    def loaded(self):
+        return self._ids is not None
+
+    @property
+    def ids(self):
+        self.load()
+        return self._ids
+
+    @property
+    def encoded(self):
+        self.load()
+        return self._encoded
+
+    @property
+    def length(self):
+        """Total residues in the genome's proteins"""
+        self.load()
+        return self._length
+
+
+class Aligner(abc.ABC):
+    """Aligns query protein sequences against every protein in a genome
+
+    Backends yield rows of strings in ALIGNMENT_COLS order, grouped by query, so that they can
+    be swapped without changing how the hits are ranked. Backends searching the same genome
+    can share its GenomeProteins.
+    """
+    name = None
+
+    def __init__(self, genome_fasta, scratch, proteins=None):
+        self.genome_fasta = genome_fasta
+        self.scratch = scratch
+        self.proteins = proteins or GenomeProteins(genome_fasta)
+
+    @abc.abstractmethod
+    def align(self, sequences, threads=1, subjects=None):
+        """Yields alignment rows for a list of RE key/sequence records
+
+        subjects optionally restricts the search to the genome proteins at those indices in
+        the FASTA file.
+        """
+
+
+class BlastAligner(Aligner):
+    """Searches a BLAST protein database built from the genome the first time it's needed
+
+    If the genome comes from a genome cache entry, the database is kept in the entry so later
+    jobs searching the same genome reuse it.
+    """
+    name = 'blastp'
+
+    def __init__(self, genome_fasta, scratch, cache=None, proteins=None):
+        super().__init__(genome_fasta, scratch, proteins)
+        self.cache = cache
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    @property
+    def has_db(self):
+        return self._db is not None
+
+    @property
+    def db(self):
+        with self._db_lock:
+            if self._db is None:
+                if self.cache is None:
+                    db_dir = os.path.join(self.scratch, "genome_db_" + str(uuid.uuid4()))
+                    self._make_blast_db(db_dir)
+                else:
+                    db_dir = self.cache.derived('blastdb', self._make_blast_db)
+                self._db = os.path.join(db_dir, "proteins")
+        return self._db
+
+    def _make_blast_db(self, db_dir):
+        """Index the genome protein FASTA as a BLAST database so it's only built once per run"""
+        db_path = os.path.join(db_dir, "proteins")
+        os.makedirs(db_dir)
+        start = time.time()
+        subprocess.run(['makeblastdb', '-in', self.genome_fasta, '-dbtype', 'prot',
+                        '-parse_seqids', '-out', db_path],
+                       check=True, stdout=subprocess.DEVNULL)
+        logging.info(f"Built BLAST database {db_path} in {time.time() - start:.2f} seconds")
+
+    def _seqidlist(self, subjects):
+        """Writes the IDs of the genome proteins at the subjects indices to a BLAST seqidlist"""
+        ids = self.proteins.ids
+        file_path = os.path.join(self.scratch, f"genome_subset_{uuid.uuid4()}.seqids")
+        with open(file_path, 'w') as outfile:
+            outfile.writelines(f'{ids[int(i)]}\n' for i in subjects)
+        return file_path
+
+    def align(self, sequences, threads=1, subjects=None):
+        """Blast the sequences against the genome, yielding tabular rows as they are produced
+
+        A subset of the genome is searched by restricting the database to the subjects' IDs,
+        with the database size fixed at the whole genome's so E values match a full search.
+        """
+        target = ['-db', self.db]
+        seqidlist = None
+        if subjects is not None:
+            seqidlist = self._seqidlist(subjects)
+            target += ['-seqidlist', seqidlist, '-dbsize', str(self.proteins.length)]
+        logging.info(f"running blastp for {len(sequences)} sequences vs {self.db}"
+                     f"{'' if subjects is None else f' restricted to {len(subjects)} proteins'}")
+        try:
+            yield from self._blastp(sequences, target, threads)
+        finally:
+            if seqidlist is not None:
+                os.remove(seqidlist)
+
+    def _blastp(self, sequences, target, threads):
+        """Runs blastp, yielding its tabular rows as they are produced
+
+        The query FASTA is fed to blastp on stdin from a separate thread so a full stdout pipe
+        can never block the write.
+        """
+        blastp_cmd = ['blastp', '-outfmt', f'6 {" ".join(ALIGNMENT_COLS)}', *target,
+                      '-num_threads', str(threads), '-query', '-']
+        start = time.time()
+        with tempfile.TemporaryFile(mode='w+', dir=self.scratch) as stderr, \
+                subprocess.Popen(blastp_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=stderr, universal_newlines=True) as proc:
+
+            def _feed_queries():
+                try:
+                    write_fasta(sequences, proc.stdin)
+                    proc.stdin.flush()
+                except BrokenPipeError:
+                    pass  # blastp exited early; the exit status explains why
+                finally:
+                    try:
+                        proc.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+            writer = threading.Thread(target=_feed_queries, daemon=True)
+            writer.start()
+            finished = False
+            try:
+                for line in proc.stdout:
+                    yield line.strip().split()
+                finished = True
+            finally:
+                if not finished:
+                    proc.kill()
+                writer.join()
+                proc.wait()
+            if proc.returncode:
+                stderr.seek(0)
+                raise RuntimeError(f"blastp failed with exit status {proc.returncode}: "
+                                   f"{stderr.read().strip()}")
+        logging.info(f"blastp search finished in {time.time() - start:.2f} seconds")
+
+
+class LocalAligner(Aligner):
+    """In-process Smith-Waterman search with BLOSUM62 and blastp's default gap costs
+
+    Each query is scored against the whole genome at once by treating the genome as one long
+    sequence with unalignable separators between proteins, so the only Python loop is over
+    query residues. Bit scores and E values use the same Karlin-Altschul parameters as BLAST,
+    without its composition-based score adjustment.
+
+    Unlike blastp, which can report several HSPs for a query/protein pair, only the best local
+    alignment of each pair is reported. A search that has a protein matching a query in more
+    than one region therefore yields fewer rows here, and a lower hit count for that protein,
+    than the same search with BlastAligner.
+    """
+    name = 'smith-waterman'
+
+    def __init__(self, genome_fasta, scratch, proteins=None):
+        super().__init__(genome_fasta, scratch, proteins)
+        self._subject = None
+        self._subject_lock = threading.Lock()
+
+    def _concatenate(self, subjects):
+        """Returns the subjects joined by separators, each protein's start and the gap ramp"""
+        proteins = self.proteins.encoded
+        parts, segments = [], []
+        for i, idx in enumerate(subjects):
+            parts += [[_SEPARATOR], proteins[idx]]
+            segments.append(np.full(len(proteins[idx]) + 1, i, dtype=np.int64))
+        subject = np.concatenate(parts).astype(np.int64)
+        starts = np.cumsum([0] + [len(proteins[idx]) + 1 for idx in subjects[:-1]])
+        # adding the ramp before a running max and removing it after gives the best gap
+        # opening to the left of every cell; the segment term stops gaps from running
+        # between proteins
+        positions = np.arange(1, len(subject) + 1, dtype=np.int64)
+        ramp = positions * GAP_EXTEND + np.concatenate(segments) * _SEGMENT_PENALTY
+        return subject, starts, ramp
+
+    def _concatenated_genome(self):
+        with self._subject_lock:
+            if self._subject is None:
+                self._subject = self._concatenate(range(len(self.proteins.ids)))
+        return self._subject
+
+    def _best_scores(self, query, concatenated):
+        """Returns the best Smith-Waterman score of the query against each concatenated protein"""
+        subject, starts, ramp = concatenated
+        h_row = np.zeros(len(subject) + 1, dtype=np.int64)
+        f_row = np.full(len(subject), _NEG_INF, dtype=np.int64)
+        best = np.zeros(len(subject), dtype=np.int64)
+        for residue in query:
+            f_row = np.maximum(h_row[1:] - GAP_OPEN - GAP_EXTEND, f_row - GAP_EXTEND)
+            h_open = np.maximum(np.maximum(h_row[:-1] + _SCORES[residue][subject], f_row), 0)
+            e_row = np.empty_like(h_open)
+            e_row[0] = _NEG_INF
+            e_row[1:] = np.maximum.accumulate(h_open + ramp)[:-1] - ramp[1:] - GAP_OPEN
+            h_row[1:] = np.maximum(h_open, e_row)
+            np.maximum(best, h_row[1:], out=best)
+        return np.maximum.reduceat(best, starts)
+
+    def align(self, sequences, threads=1, subjects=None):
+        """Yields a row for every genome protein with an E value within BLAST's default cutoff
+
+        E values are always calculated for the whole genome, so searching a subset of it
+        gives the same values as a full search.
+        """
+        if subjects is None:
+            subjects = np.arange(len(self.proteins.ids))
+            concatenated = self._concatenated_genome() if len(subjects) else None
+        else:
+            subjects = np.asarray(subjects, dtype=np.int64)
+            concatenated = self._concatenate(subjects) if len(subjects) else None
+        if concatenated is None:
+            return
+        start = time.time()
+        for seq in sequences:
+            if not seq['sequence']:
+                continue
+            query = encode(seq['sequence'])
+            scores = self._best_scores(query, concatenated)
+            evalues = K * len(query) * self.proteins.length * np.exp(-LAMBDA * scores)
+            for i in np.argsort(-scores, kind='stable'):
+                if evalues[i] > MAX_EVALUE or not scores[i]:
+                    break
+                idx = subjects[i]
+                length, mismatch, identical = _traceback(query, self.proteins.encoded[idx])
+                bitscore = (LAMBDA * scores[i] - np.log(K)) / np.log(2)
+                yield [self.proteins.ids[idx], seq['key'], _format_bitscore(bitscore),
+                       f'{100 * identical / length:.3f}', str(length), str(mismatch),
+                       _format_evalue(evalues[i])]
+        logging.info(f"Smith-Waterman search of {len(sequences)} sequences finished in "
+                     f"{time.time() - start:.2f} seconds")
+
+
+def _traceback(query, subject):
+    """Aligns a single pair and returns the length, mismatches and identities of the best hit"""
+    n = len(subject)
+    h = np.zeros((len(query) + 1, n + 1), dtype=np.int64)
+    e = np.full_like(h, _NEG_INF)
+    f = np.full_like(h, _NEG_INF)
+    ramp = np.arange(n + 1, dtype=np.int64) * GAP_EXTEND
+    for i, residue in enumerate(query, 1):
+        f[i, 1:] = np.maximum(h[i - 1, 1:] - GAP_OPEN - GAP_EXTEND, f[i - 1, 1:] - GAP_EXTEND)
+        h_open = np.zeros(n + 1, dtype=np.int64)
+        h_open[1:] = np.maximum(np.maximum(h[i - 1, :-1] + BLOSUM62[residue][subject],
+                                           f[i, 1:]), 0)
+        e[i, 1:] = np.maximum.accumulate(h_open + ramp)[:-1] - ramp[1:] - GAP_OPEN
+        h[i] = np.maximum(h_open, e[i])
+        h[i, 0] = 0
+
+    i, j = np.unravel_index(np.argmax(h), h.shape)
+    state, length, mismatch, identical = 'h', 0, 0, 0
+    while i > 0 and j > 0:
+        if state == 'h':
+            if h[i, j] == 0:
+                break
+            if h[i, j] == h[i - 1, j - 1] + BLOSUM62[query[i - 1], subject[j - 1]]:
+                length += 1
+                if query[i - 1] == subject[j - 1]:
+                    identical += 1
+                else:
+                    mismatch += 1
+                i, j = i - 1, j - 1
+            elif h[i, j] == e[i, j]:
+                state = 'e'
+            else:
+                state = 'f'
+        elif state == 'e':
+            length += 1
+            state = 'h' if e[i, j] == h[i, j - 1] - GAP_OPEN - GAP_EXTEND else 'e'
+            j -= 1
+        else:
+            length += 1
+            state = 'h' if f[i, j] == h[i - 1, j] - GAP_OPEN - GAP_EXTEND else 'f'
+            i -= 1
+    return length, mismatch, identical
@@ -1,12 +1,33 @@
 import logging
 import os
+import re
+import threading
+import time
 import uuid
-from collections import OrderedDict, Counter
-
-from kb_reaction_gene_finder.core.re_api import RE_API
-from installed_clients.FeatureSetUtilsClient import FeatureSetUtils
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from kb_reaction_gene_finder.core import hit_table
+from kb_reaction_gene_finder.core.aligners import ALIGNMENT_COLS
+from kb_reaction_gene_finder.core.checkpoint import Checkpoint
+from kb_reaction_gene_finder.core.genome_aligner import GenomeAligner
+from kb_reaction_gene_finder.core.genome_cache import GenomeCache
+from kb_reaction_gene_finder.core.hit_cache import HitCache
+from kb_reaction_gene_finder.core.kmer_index import MAX_K
+from kb_reaction_gene_finder.core.memory_profile import MemoryProfiler
+from kb_reaction_gene_finder.core.pipeline import Prefetcher, ordered_map
+from kb_reaction_gene_finder.core.query_set import QuerySet
+from kb_reaction_gene_finder.core.re_api import CircuitBreaker, RE_API, gene_reaction_index
+from kb_reaction_gene_finder.core.re_cache import RECache
+from kb_reaction_gene_finder.core.re_snapshot import LocalRE
+from kb_reaction_gene_finder.core.sequence_store import SequenceStore
+from kb_reaction_gene_finder.core.timings import Timings
 from installed_clients.GenomeFileUtilClient import GenomeFileUtil
 from installed_clients.KBaseReportClient import KBaseReport
+from installed_clients.WorkspaceClient import Workspace
+
+HIT_COLS = ['Genome Gene', 'Closest Database Gene', 'Bit Score', 'Percent Identity',
+            'Match Length', 'Mismatches', 'E Value']
 
 
 def _make_table_html(title, items, keys=None, empty_message="No items found"):
@@ -56,19 +77,121 @@ def _make_rxn_html(arango_results, gene_hits):
     return "\n".join([hits_tbl, rxn_tbl, gene_tbl])
 
 
-def _find_related_reactions(gene, rxn_gene_links):
-    return [links['rxn_id'].split('/')[1] for links in rxn_gene_links
-            if gene in links['linked_gene_ids']]
+def _make_timings_html(timings):
+    """Makes a collapsed section of the run's stage timings and counts
+
+    The report is made from the timings recorded before it, which is noted in the section.
+    """
+    stages = [{'stage': stage, 'seconds': seconds, 'spans': timings['stage_calls'][stage]}
+              for stage, seconds in timings['stage_seconds'].items()]
+    counts = [{'count': name, 'total': total} for name, total in timings['counts'].items()]
+    columns = list(dict.fromkeys(name for reaction in timings['reactions']
+                                 for name in [*reaction['stage_seconds'], *reaction['counts']]))
+    reactions = [{'reaction': reaction['reaction_id'],
+                  **{name: reaction['stage_seconds'].get(name, reaction['counts'].get(name))
+                     for name in columns}}
+                 for reaction in timings['reactions']]
+    return "\n".join(['<details class="timings">',
+                      '<summary>Run Timings</summary>',
+                      '<p>Recorded before this report was made, so the time spent making it '
+                      'and the total run time are not included. Both are in the '
+                      "<code>timings</code> of the app's results.</p>",
+                      _make_table_html("Stages", stages),
+                      _make_table_html("Counts", counts),
+                      _make_table_html("Reactions", reactions, ['reaction'] + columns,
+                                       "No reactions were searched in this run."),
+                      '</details>'])
+
+
+def _cpu_budget():
+    """Returns the number of cores this job may actually use, honoring cgroup CPU quotas"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+            quota, period = cpu_max.read().split()
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as quota_file, \
+                    open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as period_file:
+                quota, period = quota_file.read().strip(), period_file.read().strip()
+        except OSError:
+            return cores
+    if quota in ('max', '-1'):
+        return cores
+    return max(1, min(cores, int(quota) // int(period)))
+
+
+def _rank_hits(table, gene_reactions, noise_level=50, number_vals_to_report=5):
+    """Filters hits below the noise level and returns the top scoring genome genes"""
+    best_rows, hit_counts = hit_table.rank_hits(table, noise_level, number_vals_to_report)
+    top_records = [{**dict(zip(HIT_COLS, (str(row[col]) for col in ALIGNMENT_COLS))),
+                    "Total Gene Hits": str(hit_count),
+                    "Associated Reactions": ", ".join(gene_reactions.get(row['qseqid'], []))}
+                   for row, hit_count in zip(best_rows, hit_counts)]
+    top_genes = best_rows['sseqid'].tolist()
+
+    return top_records, top_genes
 
 
 class AppImpl:
     def __init__(self, config, ctx):
         self.callback_url = os.environ['SDK_CALLBACK_URL']
         self.scratch = config['scratch']
-        self.re_api = RE_API(config['re-api'], ctx['token'])
-        self.fsu = FeatureSetUtils(self.callback_url)
+        self.local_aligner_max_cells = float(config.get('local-aligner-max-cells', 2e7))
+        self.kmer_size = int(config.get('kmer-size', 3))
+        if not 1 <= self.kmer_size <= MAX_K:
+            raise ValueError(f"kmer-size must be between 1 and {MAX_K}, not {self.kmer_size}")
+        self.timings = Timings()
+        self.memory_profile = config.get('memory-profile', 'false').lower() == 'true'
+        self.memory_profile_top = int(config.get('memory-profile-top', 10))
+        self.memory = MemoryProfiler()
+        # whether each reaction's stages are marked in the memory profile
+        self.mark_reactions = True
+        self.hit_cache = None
+        self.genome_cache = None
+        re_cache = None
+        sequence_store = None
+        if config.get('cache-dir'):
+            self.hit_cache = HitCache(os.path.join(config['cache-dir'], 'hits'),
+                                      float(config.get('hit-cache-max-mb', 1024)) * 2**20)
+            self.genome_cache = GenomeCache(
+                os.path.join(config['cache-dir'], 'genomes'),
+                float(config.get('genome-cache-max-mb', 10240)) * 2**20)
+            if float(config.get('re-cache-ttl-hours', 24)) > 0:
+                re_cache = RECache(os.path.join(config['cache-dir'], 're'),
+                                   float(config.get('re-cache-ttl-hours', 24)) * 3600)
+            if config.get('re-two-phase', 'false').lower() == 'true':
+                sequence_store = SequenceStore(os.path.join(config['cache-dir'], 'sequences'))
+        if config.get('re-snapshot'):
+            self.re_api = LocalRE(config['re-snapshot'])
+        else:
+            self.re_api = RE_API(config['re-api'], ctx['token'],
+                                 pool_size=int(config.get('re-pool-size', 10)),
+                                 timeout=(float(config.get('re-connect-timeout', 10)),
+                                          float(config.get('re-read-timeout', 300))),
+                                 cache=re_cache,
+                                 retries=int(config.get('re-retries', 2)),
+                                 backoff=float(config.get('re-backoff-seconds', 1)),
+                                 deadline=float(config.get('re-deadline-seconds', 600)),
+                                 breaker=CircuitBreaker(
+                                     int(config.get('re-breaker-failures', 5)),
+                                     float(config.get('re-breaker-reset-seconds', 60))),
+                                 sequence_store=sequence_store,
+                                 timings=self.timings)
+        self.re_batch_size = int(config.get('re-batch-size', 1))
+        self.re_max_concurrency = int(config.get('re-max-concurrency', 8))
+        self.re_request_timeout = float(config.get('re-request-timeout', 0)) or None
+        self.pipeline_depth = int(config.get('pipeline-depth') or 2 * self.re_max_concurrency)
+        # gene ID -> reaction keys (as an insertion ordered dict) across all fetched reactions
+        self.gene_reactions = {}
+        self._gene_reactions_lock = threading.Lock()
         self.gfu = GenomeFileUtil(self.callback_url)
         self.kbr = KBaseReport(self.callback_url)
+        self.ws = Workspace(config['workspace-url'], token=ctx['token'])
+        self.ctx = ctx
 
     @staticmethod
     def _validate_params(params, required, optional=set()):
@@ -98,120 +221,358 @@ class AppImpl:
 
         return params['reaction_set']
 
-    @staticmethod
-    def _make_fasta(sequences, file_path):
-        """Make a FASTA file from RE query output"""
-        if not sequences or not isinstance(sequences, list) or "key" not in sequences[0] \
-                or "sequence" not in sequences[0]:
-            raise ValueError(f"Unexpected input type:{sequences}")
-        with open(file_path, 'w') as outfile:
-            for seq in sequences:
-                if seq["sequence"]:
-                    outfile.write(f'>{seq["key"]}\n{seq["sequence"]}\n')
-
-    def _make_feature_set(self, workspace, genome, fs_name_prefix, reaction_id, top_genes):
-        params = {
-            'genome': genome,
-            'feature_ids': top_genes,
-            'workspace_name': workspace,
-            'description': f'A set of the top gene candidates for {reaction_id} calculated '
-                           f'by the "Find Candidate Genes for a Reaction" app',
-            'output_feature_set': f'{fs_name_prefix}_{reaction_id}',
-         }
-        return self.fsu.build_feature_set(params)['feature_set_ref']
-
-    def _find_best_homologs(self, query_seq_file, target_seq_file, rxn_gene_links,
-                            noise_level=50, number_vals_to_report=5, threads=1):
-        """Blast the query_seq_file against the target_seq_file and return the best hits"""
-        logging.info("running blastp for {0} vs {1}".format(query_seq_file, target_seq_file))
-        out_cols = ['sseqid', 'qseqid', 'bitscore', 'pident', 'length', 'mismatch', 'evalue']
-        col_names = ['Genome Gene', 'Closest Database Gene', 'Bit Score', 'Percent Identity',
-                     'Match Length', 'Mismatches', 'E Value']
-
-        tmp_blast_output_file = os.path.join(self.scratch, "blastp.results" + str(uuid.uuid4()))
-
-        blastp_cmd = f'blastp -outfmt "6 {" ".join(out_cols)}" -subject {target_seq_file} '\
-                     f'-num_threads {threads} -query {query_seq_file} > {tmp_blast_output_file}'
-        os.system(blastp_cmd)
-
-        gene_hits = dict()
-        top_bitscore = Counter()
-        gene_hit_count = Counter()
-
-        with open(tmp_blast_output_file) as bl:
-            for line in bl:
-                cols = OrderedDict(zip(col_names, line.strip().split()))
-                bl_score = float(cols['Bit Score'])
-                if bl_score < noise_level:
-                    continue
-
-                gene_hit_count[cols['Genome Gene']] += 1
-                if cols['Genome Gene'] not in gene_hits or \
-                        top_bitscore[cols['Genome Gene']] < bl_score:
-                    gene_hits[cols['Genome Gene']] = cols
-                    top_bitscore[cols['Genome Gene']] = float(cols['Bit Score'])
-
-        top_genes = [gene[0] for gene in top_bitscore.most_common(number_vals_to_report)]
-        top_records = [{**gene_hits[gene],
-                        "Total Gene Hits": str(gene_hit_count[gene]),
-                        "Associated Reactions": ", ".join(_find_related_reactions(
-                            gene_hits[gene]['Closest Database Gene'], rxn_gene_links))}
-                       for gene in top_genes]
-
-        return top_records, top_genes
+    def _save_feature_sets(self, workspace, genome, fs_name_prefix, rxn_genes):
+        """Saves a feature set of the top genes for each (reaction ID, genes) pair
+
+        The FeatureSet objects are built here and saved with a single workspace call rather
+        than a FeatureSetUtils call each. Returns the references in rxn_genes order.
+        """
+        provenance = self.ctx.provenance()
+        objects = [{
+            'type': 'KBaseCollections.FeatureSet',
+            'name': f'{fs_name_prefix}_{reaction_id}',
+            'data': {
+                'description': f'A set of the top gene candidates for {reaction_id} '
+                               f'calculated by the "Find Candidate Genes for a Reaction" app',
+                'element_ordering': top_genes,
+                'elements': {gene: [genome] for gene in top_genes}},
+            'provenance': provenance,
+        } for reaction_id, top_genes in rxn_genes]
+        infos = self.ws.save_objects({'workspace': workspace, 'objects': objects})
+        logging.info(f"Saved {len(infos)} feature sets")
+        return [f'{info[6]}/{info[0]}/{info[4]}' for info in infos]
+
+    def _search_genes(self, gene_lists, genome, threads=1):
+        """Align every unique sequence in gene_lists once and fan the rows out to each list
+
+        Returns a hit table for each list of genes, in the order the rows would have been
+        produced by searching that list on its own. Searches of a previously seen set of
+        sequences are answered from the hit cache when one is configured, and the genome
+        aligner skips sequences it already searched earlier in the run.
+        """
+        if genome.prefiltered and len(gene_lists) > 1:
+            # the k-mer candidates are picked for all of a search's queries, so each list is
+            # searched on its own to be aligned against the candidates it would have alone
+            return [self._search_genes([genes], genome, threads)[0] for genes in gene_lists]
+        query_set = QuerySet()
+        gene_hashes = [query_set.add(genes) for genes in gene_lists]
+        rows = []
+        if query_set:
+            rows = None
+            if self.hit_cache:
+                cache_key = HitCache.key(query_set.sequences, genome.genome_hash,
+                                         genome.search_params())
+                rows = self.hit_cache.get(cache_key)
+                if rows is not None:
+                    self.timings.count('hit_cache_hits')
+            if rows is None:
+                rows = genome.align(query_set.records(), threads)
+                if self.hit_cache:
+                    rows = self.hit_cache.tee(cache_key, rows)
+        table = hit_table.from_rows(rows)
+        return [hit_table.fan_out(table, hashes) for hashes in gene_hashes]
+
+    def _find_best_homologs(self, genes, genome, gene_reactions,
+                            noise_level=50, number_vals_to_report=5, threads=1, reaction=None):
+        """Align the genes against the genome and return the best hits"""
+        with self.timings.span('alignment', reaction):
+            table = self._search_genes([genes], genome, threads)[0]
+        return self._rank_and_count_hits(table, gene_reactions, noise_level,
+                                         number_vals_to_report, reaction)
+
+    def _rank_and_count_hits(self, table, gene_reactions, noise_level, number_vals_to_report,
+                             reaction):
+        """Ranks a reaction's hits, recording the rows searched and passing the noise level"""
+        with self.timings.span('ranking', reaction):
+            ranked = _rank_hits(table, gene_reactions, noise_level, number_vals_to_report)
+        self.timings.count('alignment_rows', len(table), reaction)
+        self.timings.count('rows_above_floor', (table['score'] >= noise_level).sum(), reaction)
+        return ranked
+
+    def _count_re_results(self, reaction, arango_results):
+        self.timings.count('re_genes', len(arango_results.get('genes') or []), reaction)
+        self.timings.count('missing_genes', len(arango_results.get('missing_genes') or []),
+                           reaction)
 
     def find_genes_from_similar_reactions(self, params):
         reaction_ids = self._validate_params(
             params, {'workspace_name', 'query_genome_ref', },
             {'number_of_hits_to_report', 'smarts_set', 'blast_score_floor',
             'structural_similarity_floor', 'difference_similarity_floor',
-            'reaction_set', 'bulk_reaction_ids'})
+            'reaction_set', 'bulk_reaction_ids', 'batch_blast', 'max_workers',
+             'kmer_min_shared', 'kmer_recall_check', 'memory_profile'})
+
+        start = time.perf_counter()
+        if params.get('memory_profile') is not None:
+            self.memory_profile = bool(params['memory_profile'])
+        self.memory = MemoryProfiler(self.memory_profile, self.memory_profile_top)
+        self.memory.start()
+        try:
+            checkpoint = Checkpoint(os.path.join(self.scratch, 'checkpoints',
+                                                 self._checkpoint_key(reaction_ids, params)))
+            done = checkpoint.load(reaction_ids)
+            pending = [rxn for i, rxn in enumerate(reaction_ids) if i not in done]
+            with ExitStack() as stack:
+                pending_results = []
+                if pending:
+                    # RE results are fetched in the background, ahead of the searches and while the
+                    # genome is downloaded, and each stage hands its results on in reaction order
+                    related = Prefetcher(self._iter_related_sequences(pending, params),
+                                         self.pipeline_depth)
+                    stack.callback(related.close)
+                    feature_seq_path, entry = stack.enter_context(
+                        self._genome_proteins(params['query_genome_ref']))
+                    genome = GenomeAligner(
+                        feature_seq_path, self.scratch, self.local_aligner_max_cells,
+                        kmer_min_shared=int(params.get('kmer_min_shared') or 0),
+                        kmer_size=self.kmer_size,
+                        kmer_recall_floor=(params.get('blast_score_floor', 50)
+                                           if params.get('kmer_recall_check') else None),
+                        cache=entry, timings=self.timings)
+                    self.memory.mark('genome_download')
+                    pending_results = self._search_reactions(pending, related, genome, params)
+                output, html_tables = self._make_outputs(
+                    reaction_ids,
+                    self._checkpointed(reaction_ids, checkpoint, done, pending_results),
+                    params, checkpoint)
+            with self.timings.span('report'):
+                output.update(self._build_report(reaction_ids,
+                                                 html_tables,
+                                                 output['feature_set_refs'],
+                                                 params['workspace_name'],
+                                                 ))
+            checkpoint.clear()
+            self.timings.add('total', time.perf_counter() - start)
+            output['timings'] = self.timings.as_dict()
+            logging.info(f"Run timings: {output['timings']['stage_seconds']}")
+            self.memory.mark('report')
+            return output
+        finally:
+            # also written when the run fails, which stops tracing either way
+            self.memory.write_summary(os.path.join(self.scratch, 'memory_profile.txt'))
+
+    def _checkpoint_key(self, reaction_ids, params):
+        """Returns the checkpoint name for a run from only the inputs that change its results
+
+        Workers, batching and profiling don't change the results, so a rerun with them changed
+        resumes. The recall check searches without the prefilter.
+        """
+        return Checkpoint.key({
+            'reaction_ids': reaction_ids,
+            'genome': self._resolve_ref(params['query_genome_ref']),
+            'workspace_name': params['workspace_name'],
+            'structural_similarity_floor': params.get('structural_similarity_floor', 1),
+            'difference_similarity_floor': params.get('difference_similarity_floor', 1),
+            'blast_score_floor': params.get('blast_score_floor', 50),
+            'number_of_hits_to_report': params.get('number_of_hits_to_report', 5),
+            'feature_set_prefix': params.get('feature_set_prefix', 'gene_candidates'),
+            'kmer_min_shared': (0 if params.get('kmer_recall_check')
+                                else int(params.get('kmer_min_shared') or 0)),
+            'kmer_size': self.kmer_size,
+            'local_aligner_max_cells': self.local_aligner_max_cells})
+
+    @contextmanager
+    def _genome_proteins(self, genome_ref):
+        """Yields the genome's protein FASTA path and its genome cache entry, if caching is on"""
+        def fetch(ref):
+            with self.timings.span('genome_download'):
+                return self.gfu.genome_proteins_to_fasta(
+                    {'genome_ref': ref,
+                     'include_functions': True,
+                     'include_aliases': False})['file_path']
+
+        if self.genome_cache is None:
+            yield fetch(genome_ref), None
+            return
+        # fetch the resolved version so the FASTA always matches the cache key
+        upa = self._resolve_ref(genome_ref)
+        entry = self.genome_cache.open(upa, lambda: fetch(upa))
+        try:
+            yield entry.fasta, entry
+        finally:
+            entry.close()
+
+    def _resolve_ref(self, ref):
+        """Returns the versioned workspace/object/version reference for an object reference"""
+        if re.match(r'^\d+/\d+/\d+$', ref):
+            return ref
+        info = self.ws.get_object_info3({'objects': [{'ref': ref}]})['infos'][0]
+        return f'{info[6]}/{info[0]}/{info[4]}'
+
+    def _search_reactions(self, reaction_ids, related, genome, params):
+        """Yields the search results for each reaction, in order, as related yields RE results"""
+        cpus = _cpu_budget()
+        workers = max(1, min(int(params.get('max_workers') or 1), cpus, len(reaction_ids)))
+        if params.get('batch_blast'):
+            return self.find_genes_for_rxns_batched(reaction_ids, genome, params, cpus,
+                                                    list(related))
+        if workers > 1:
+            # concurrent reactions' memory can't be told apart
+            self.mark_reactions = False
+            threads = cpus // workers
+            logging.info(f"Searching {len(reaction_ids)} reactions with {workers} workers "
+                         f"and {threads} BLAST threads each")
+            return self._search_reactions_concurrently(reaction_ids, related, genome, params,
+                                                       workers, threads)
+        return (self.find_genes_for_rxn(rxn, genome, params, cpus, arango_results)
+                for rxn, arango_results in zip(reaction_ids, related))
+
+    def _search_reactions_concurrently(self, reaction_ids, related, genome, params, workers,
+                                       threads):
+        # searches are mostly waiting on a blastp subprocess so threads are sufficient
+        with ThreadPoolExecutor(workers) as executor:
+            yield from ordered_map(
+                executor,
+                lambda rxn_results: self.find_genes_for_rxn(rxn_results[0], genome, params,
+                                                            threads, rxn_results[1]),
+                zip(reaction_ids, related), workers * 2)
 
-        feature_seq_path = self.gfu.genome_proteins_to_fasta(
-            {'genome_ref': params['query_genome_ref'],
-             'include_functions': True,
-             'include_aliases': False})['file_path']
+    @staticmethod
+    def _checkpointed(reaction_ids, checkpoint, done, pending_results):
+        """Yields every reaction's results in order, saving each newly finished one
 
+        done holds the results already in the checkpoint by reaction index and pending_results
+        the results of the other reactions, in order.
+        """
+        pending_results = iter(pending_results)
+        for i, rxn in enumerate(reaction_ids):
+            if i in done:
+                yield done[i]
+                continue
+            result = next(pending_results)
+            checkpoint.save(i, rxn, result)
+            yield result
+
+    def _make_outputs(self, reaction_ids, rxn_results, params, checkpoint):
+        """Collects the gene hits and saves a feature set for each reaction with hits"""
         output = {'gene_hits': [], 'feature_set_refs': []}
         html_tables = []
-        for rxn in reaction_ids:
-            hits, genes, html = self.find_genes_for_rxn(rxn, feature_seq_path, params)
+        rxn_genes = []
+        for rxn, (hits, genes, html) in zip(reaction_ids, rxn_results):
             if genes:
-                output['feature_set_refs'].append(
-                    self._make_feature_set(params['workspace_name'],
-                                           params['query_genome_ref'],
-                                           params.get('feature_set_prefix', 'gene_candidates'),
-                                           rxn,
-                                           genes))
+                rxn_genes.append((rxn, genes))
             output['gene_hits'].extend(hits)
             html_tables.append(html)
-        output.update(self._build_report(reaction_ids,
-                                         html_tables,
-                                         output['feature_set_refs'],
-                                         params['workspace_name'],
-                                         ))
-        return output
-
-    def find_genes_for_rxn(self, reaction, genome_feature_path, params):
-        """Finds genes for a particular reaction using RE and BLAST"""
-        arango_results = self.re_api.get_related_sequences(
+        self.memory.mark('gene_hits')
+        output['feature_set_refs'] = checkpoint.load_feature_set_refs()
+        if output['feature_set_refs'] is None:
+            output['feature_set_refs'] = []
+            if rxn_genes:
+                with self.timings.span('feature_sets'):
+                    output['feature_set_refs'] = self._save_feature_sets(
+                        params['workspace_name'],
+                        params['query_genome_ref'],
+                        params.get('feature_set_prefix', 'gene_candidates'),
+                        rxn_genes)
+            checkpoint.save_feature_set_refs(output['feature_set_refs'])
+            self.memory.mark('feature_sets')
+        return output, html_tables
+
+    def _get_related_sequences(self, reaction, params):
+        """Fetches the RE results for a reaction and indexes its genes' linked reactions"""
+        return self._index_related_sequences(self.re_api.get_related_sequences(
             reaction,
             params.get('structural_similarity_floor', 1),
-            params.get('difference_similarity_floor', 1))
+            params.get('difference_similarity_floor', 1)))
+
+    def _iter_related_sequences(self, reactions, params):
+        """Yields the RE results for a list of reactions in order, re-batch-size per query
+
+        Up to re-max-concurrency queries run at once.
+        """
+        sf_sim = params.get('structural_similarity_floor', 1)
+        df_sim = params.get('difference_similarity_floor', 1)
+        batch_size = max(1, self.re_batch_size)
+        batches = (reactions[i:i + batch_size] for i in range(0, len(reactions), batch_size))
+        if self.re_batch_size <= 1:
+            def fetch(batch):
+                with self.timings.span('re_fetch'):
+                    return [self.re_api.get_related_sequences(batch[0], sf_sim, df_sim,
+                                                              timeout=self.re_request_timeout)]
+        else:
+            def fetch(batch):
+                with self.timings.span('re_fetch'):
+                    return self.re_api.get_related_sequences_batch(
+                        batch, sf_sim, df_sim, timeout=self.re_request_timeout)
+        with ThreadPoolExecutor(self.re_max_concurrency) as executor:
+            for batch_results in ordered_map(executor, fetch, batches, self.re_max_concurrency):
+                for arango_results in batch_results:
+                    yield self._index_related_sequences(arango_results)
+
+    def _index_related_sequences(self, arango_results):
+        """Indexes the reactions linked to each gene in an RE result"""
+        arango_results['gene_reactions'] = gene_reaction_index(
+            arango_results.get('rxn_gene_links') or [])
+        with self._gene_reactions_lock:
+            for gene, rxn_keys in arango_results['gene_reactions'].items():
+                self.gene_reactions.setdefault(gene, dict()).update(dict.fromkeys(rxn_keys))
+        return arango_results
+
+    def related_reactions(self, gene):
+        """Returns the keys of every reaction linked to a gene in any RE result of this run"""
+        with self._gene_reactions_lock:
+            return list(self.gene_reactions.get(gene, ()))
+
+    def find_genes_for_rxn(self, reaction, genome, params, threads=1, arango_results=None):
+        """Finds genes for a particular reaction using RE and BLAST
+
+        arango_results may be passed in if the reaction's RE results were already fetched.
+        """
+        if arango_results is None:
+            with self.timings.span('re_fetch', reaction):
+                arango_results = self._get_related_sequences(reaction, params)
+        self._count_re_results(reaction, arango_results)
+        self._mark_reaction(reaction, 're_results')
         if not arango_results.get('genes'):
             return [], [], _make_rxn_html(arango_results, [])
 
-        search_fasta = f'{self.scratch}/rxn_search_{uuid.uuid4()}.fasta'
-        self._make_fasta(arango_results['genes'], search_fasta)
-
-        hits, genes = self._find_best_homologs(search_fasta,
-                                        genome_feature_path,
-                                        arango_results['rxn_gene_links'],
+        hits, genes = self._find_best_homologs(arango_results['genes'],
+                                        genome,
+                                        arango_results['gene_reactions'],
                                         params.get('blast_score_floor', 50),
-                                        params.get('number_of_hits_to_report', 5))
+                                        params.get('number_of_hits_to_report', 5),
+                                        threads, reaction)
+        self._mark_reaction(reaction, 'alignment')
         html = _make_rxn_html(arango_results, hits)
+        self._mark_reaction(reaction, 'html')
         return hits, genes, html
 
+    def _mark_reaction(self, reaction, stage):
+        if self.mark_reactions:
+            self.memory.mark(f'{reaction} {stage}')
+
+    def find_genes_for_rxns_batched(self, reactions, genome, params, threads=1,
+                                    all_arango_results=None):
+        """Finds genes for a list of reactions with a single BLAST search of all related genes
+
+        Each unique sequence is searched once and the hits are split back out per reaction so
+        they are ranked exactly as find_genes_for_rxn would rank them. With the k-mer prefilter
+        on, each reaction's genes are searched separately against their own candidates.
+        """
+        if all_arango_results is None:
+            all_arango_results = list(self._iter_related_sequences(reactions, params))
+        self.memory.mark('re_results')
+        with self.timings.span('alignment'):
+            rxn_tables = self._search_genes([arango_results.get('genes') or []
+                                             for arango_results in all_arango_results],
+                                            genome, threads)
+        self.memory.mark('alignment')
+
+        results = []
+        for reaction, arango_results, table in zip(reactions, all_arango_results, rxn_tables):
+            self._count_re_results(reaction, arango_results)
+            if not arango_results.get('genes'):
+                results.append(([], [], _make_rxn_html(arango_results, [])))
+                continue
+            hits, genes = self._rank_and_count_hits(table,
+                                                    arango_results['gene_reactions'],
+                                                    params.get('blast_score_floor', 50),
+                                                    params.get('number_of_hits_to_report', 5),
+                                                    reaction)
+            results.append((hits, genes, _make_rxn_html(arango_results, hits)))
+            self._mark_reaction(reaction, 'html')
+        return results
+
     def _build_report(self, reaction_ids, html_tables, feature_sets, workspace_name):
         """
         _generate_report: generate summary report for upload
@@ -254,6 +615,7 @@ class AppImpl:
         lines.append('</div>')
         lines += [f'<div id={rid} class="tabcontent">\n{html}\n</div>'
                   for rid, html in zip([first_id]+reactions, html_tables)]
+        lines.append(_make_timings_html(self.timings.as_dict()))
 
         # Fill in template HTML
         with open(os.path.join(os.path.dirname(__file__), 'find_genes_for_rxn_template.html')
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+
+class Checkpoint:
+    """Per-reaction results of a run saved to disk as they finish, so a rerun can resume
+
+    Each reaction's (hits, genes, html) results are a JSON file named by the reaction's
+    position in the run, written to a temporary file and renamed so a crash never leaves a
+    partial result behind. The run's feature set references are saved once they're created.
+    A run clears its checkpoint once it succeeds, so only failed runs are resumed.
+    """
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    @staticmethod
+    def key(inputs):
+        """Returns the checkpoint name for the inputs that determine a run's results
+
+        inputs should leave out settings that only change how the run is carried out, so a
+        rerun with them changed still resumes, and should include the query genome's resolved
+        version, so a run on a newer version doesn't resume from an older one's results.
+        """
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def _write(self, name, data):
+        tmp_path = os.path.join(self.path, f'.tmp-{uuid.uuid4()}')
+        with open(tmp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name)) as infile:
+            return json.load(infile)
+
+    def load(self, reaction_ids):
+        """Returns {reaction index: (hits, genes, html)} for the reactions already finished"""
+        done = {}
+        for i, reaction_id in enumerate(reaction_ids):
+            if os.path.exists(os.path.join(self.path, f'{i}.json')):
+                result = self._read(f'{i}.json')
+                if result['reaction'] == reaction_id:
+                    done[i] = (result['hits'], result['genes'], result['html'])
+        if done:
+            logging.info(f"Resuming from checkpoint {self.path} with {len(done)} of "
+                         f"{len(reaction_ids)} reactions finished")
+        return done
+
+    def save(self, index, reaction_id, result):
+        hits, genes, html = result
+        self._write(f'{index}.json',
+                    {'reaction': reaction_id, 'hits': hits, 'genes': genes, 'html': html})
+
+    def load_feature_set_refs(self):
+        if not os.path.exists(os.path.join(self.path, 'feature_set_refs.json')):
+            return None
+        return self._read('feature_set_refs.json')
+
+    def save_feature_set_refs(self, refs):
+        self._write('feature_set_refs.json', refs)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
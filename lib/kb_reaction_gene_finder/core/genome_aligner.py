@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import threading
+
+from kb_reaction_gene_finder.core.aligners import (ALIGNMENT_COLS, BlastAligner, GenomeProteins,
+                                                   LocalAligner)
+from kb_reaction_gene_finder.core.kmer_index import KmerIndex
+from kb_reaction_gene_finder.core.timings import Timings
+
+
+class GenomeAligner:
+    """Aligns query sequences against a genome with the cheapest suitable backend
+
+    When kmer_min_shared is set, a k-mer index of the genome proteins picks the candidates that
+    share enough k-mers with the queries and only those are aligned. A search is sent to the
+    in-process aligner if its query x candidate residues are below local_max_cells, otherwise
+    to BLAST. The genome proteins are read, and the BLAST database and k-mer index built, only
+    if a search needs them.
+
+    When kmer_recall_floor is set, every search is run with blastp against the whole genome
+    and the fraction of hits scoring above the floor that each k-mer threshold would have kept
+    is logged, so a safe threshold can be chosen.
+
+    If cache is a genome cache entry, the BLAST database and k-mer index are kept in it and
+    reused by later jobs searching the same genome. Reading the proteins and building the
+    database and index are timed as the genome_index stage, apart from the searches.
+
+    The rows of each query searched against the whole genome are kept for the life of the
+    aligner, so a sequence that comes up again in a later search of the run isn't aligned again.
+    """
+    def __init__(self, genome_fasta, scratch, local_max_cells=2e7, kmer_min_shared=0,
+                 kmer_size=3, kmer_recall_floor=None, cache=None, timings=None):
+        self.cache = cache
+        self.timings = timings or Timings()
+        self.genome_fasta = genome_fasta
+        self.proteins = GenomeProteins(genome_fasta)
+        self.blast = BlastAligner(genome_fasta, scratch, cache, self.proteins)
+        self.local = LocalAligner(genome_fasta, scratch, self.proteins)
+        self.local_max_cells = local_max_cells
+        self.kmer_min_shared = kmer_min_shared
+        self.kmer_size = kmer_size
+        self.kmer_recall_floor = kmer_recall_floor
+        self._kmer_index = None
+        self._kmer_lock = threading.Lock()
+        self._genome_hash = None
+        # (backend name, query key) -> rows of the query against the whole genome
+        self._rows = {}
+
+    @property
+    def genome_hash(self):
+        """SHA-1 of the genome protein FASTA, identifying the protein set in cache keys"""
+        if self._genome_hash is None and self.cache is not None:
+            self._genome_hash = self.cache.sha1
+        if self._genome_hash is None:
+            genome_hash = hashlib.sha1()
+            with open(self.genome_fasta, 'rb') as genome_file:
+                for chunk in iter(lambda: genome_file.read(2**20), b''):
+                    genome_hash.update(chunk)
+            self._genome_hash = genome_hash.hexdigest()
+        return self._genome_hash
+
+    def search_params(self):
+        """Returns the settings that can change the rows a search produces"""
+        return {'local_max_cells': self.local_max_cells,
+                'kmer_min_shared': self.kmer_min_shared,
+                'kmer_size': self.kmer_size,
+                'kmer_recall_floor': self.kmer_recall_floor,
+                'columns': ALIGNMENT_COLS}
+
+    @property
+    def prefiltered(self):
+        """Whether searches only align the candidates picked for their own queries"""
+        return bool(self.kmer_min_shared) and self.kmer_recall_floor is None
+
+    @property
+    def kmer_index(self):
+        with self._kmer_lock:
+            if self._kmer_index is None:
+                with self.timings.span('genome_index', exclusive=True):
+                    if self.cache is not None:
+                        self._kmer_index = KmerIndex.load(self.cache.derived(
+                            f'kmers_{self.kmer_size}.npz',
+                            lambda path: KmerIndex.build(self.proteins.encoded,
+                                                         self.kmer_size).save(path)))
+                    else:
+                        self._kmer_index = KmerIndex.build(self.proteins.encoded, self.kmer_size)
+        return self._kmer_index
+
+    def _prepare(self, aligner):
+        """Reads the genome proteins and builds the BLAST database if a search needs it"""
+        if not self.proteins.loaded or (aligner is self.blast and not self.blast.has_db):
+            with self.timings.span('genome_index', exclusive=True):
+                self.proteins.load()
+                if aligner is self.blast:
+                    # the first use of the database builds it
+                    self.blast.db
+
+    def select(self, sequences, subjects=None):
+        """Returns the backend for a search, based on the size of its dynamic programming grid"""
+        query_length = sum(len(seq['sequence'] or '') for seq in sequences)
+        if subjects is None:
+            subject_length = self.proteins.length
+        else:
+            subject_length = sum(len(self.proteins.encoded[idx]) for idx in subjects)
+        if query_length * subject_length <= self.local_max_cells:
+            return self.local
+        return self.blast
+
+    def align(self, sequences, threads=1):
+        """Yields alignment rows for a list of RE key/sequence records"""
+        self._prepare(None)
+        if self.kmer_recall_floor is not None:
+            yield from self._check_kmer_recall(sequences, threads)
+            return
+
+        subjects = None
+        if self.prefiltered:
+            subjects = self.kmer_index.candidates(sequences, self.kmer_min_shared)
+            logging.info(f"k-mer prefilter kept {len(subjects)} of {len(self.proteins.ids)} "
+                         f"genome proteins")
+            if not len(subjects):
+                return
+        aligner = self.select(sequences, subjects)
+        self._prepare(aligner)
+        logging.info(f"Aligning {len(sequences)} sequences with {aligner.name}")
+        if subjects is None:
+            yield from self._align_remembered(aligner, sequences, threads)
+        else:
+            yield from aligner.align(sequences, threads, subjects)
+
+    def _align_remembered(self, aligner, sequences, threads):
+        """Yields the rows of a whole genome search, aligning only sequences not seen before
+
+        A query's rows against the whole genome don't depend on the other queries searched with
+        it, so the rows remembered from earlier searches with the same backend are replayed in
+        query order. Query keys must identify their sequence, as QuerySet's hashes do.
+        """
+        new_keys = {seq['key'] for seq in sequences if (aligner.name, seq['key']) not in self._rows}
+        if len(new_keys) < len(sequences):
+            logging.info(f"Reusing the alignments of {len(sequences) - len(new_keys)} of "
+                         f"{len(sequences)} sequences")
+        new = [seq for seq in sequences if seq['key'] in new_keys]
+        rows = aligner.align(new, threads) if new else iter(())
+        try:
+            row = next(rows, None)
+            for seq in sequences:
+                if seq['key'] not in new_keys:
+                    yield from self._rows[(aligner.name, seq['key'])]
+                    continue
+                # backends yield rows grouped by query, in query order
+                seq_rows = []
+                while row is not None and row[1] == seq['key']:
+                    seq_rows.append(row)
+                    yield row
+                    row = next(rows, None)
+                self._rows[(aligner.name, seq['key'])] = seq_rows
+            if row is not None:
+                raise RuntimeError(f"{aligner.name} returned rows out of query order")
+        finally:
+            if new:
+                rows.close()
+
+    def _check_kmer_recall(self, sequences, threads):
+        """Runs a full blastp search and logs the share of its hits each k-mer threshold keeps"""
+        self._prepare(self.blast)
+        rows = list(self.blast.align(sequences, threads))
+        recall = self.kmer_index.recall(sequences, rows, self.proteins.ids, self.kmer_recall_floor)
+        logging.info(f"k-mer prefilter recall of hits scoring at least {self.kmer_recall_floor}"
+                     f" (minimum shared {self.kmer_size}-mers: recall): " +
+                     ", ".join(f"{threshold}: {fraction:.3f}"
+                               for threshold, fraction in recall.items()))
+        return rows
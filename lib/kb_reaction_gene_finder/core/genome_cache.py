@@ -0,0 +1,167 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+
+@contextmanager
+def _flock(lock_path, mode=fcntl.LOCK_EX):
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, mode)
+        try:
+            yield lock_file
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _file_sha1(file_path):
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(2**20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+class GenomeCacheEntry:
+    """A cached genome protein FASTA and the indexes derived from it
+
+    The entry holds its use lock shared until it's closed so that no other job evicts it while
+    it's in use.
+    """
+    def __init__(self, path, lock_file, sha1):
+        self.path = path
+        self.sha1 = sha1
+        self._lock_file = lock_file
+
+    @property
+    def fasta(self):
+        return os.path.join(self.path, 'proteins.fasta')
+
+    def derived(self, name, build):
+        """Returns the path of a file or directory derived from the FASTA, building it if needed
+
+        build is called with a temporary path to create, which is then moved into place, so
+        concurrent jobs never see a partial build.
+        """
+        target = os.path.join(self.path, name)
+        with _flock(os.path.join(self.path, f'.{name}.lock')):
+            if not os.path.exists(target):
+                tmp_path = os.path.join(self.path, f'.tmp-{uuid.uuid4()}-{name}')
+                build(tmp_path)
+                os.rename(tmp_path, target)
+                logging.info(f"Added {name} to genome cache entry {self.path}")
+        return target
+
+    def close(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+
+class GenomeCache:
+    """Genome protein FASTA files shared between jobs, keyed by resolved workspace reference
+
+    Workspace object versions are immutable, so an entry stays valid as long as its FASTA
+    still has the size and modification time recorded when it was added. Entries not used
+    recently are evicted once the cache grows past max_bytes, skipping any that a job has open.
+
+    Each entry has two locks: a use lock that jobs hold shared for as long as they have the
+    entry open and that eviction needs exclusively, and a fill lock held exclusively while the
+    entry is checked or filled.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, upa):
+        return os.path.join(self.cache_dir, upa.replace('/', '_'))
+
+    @staticmethod
+    def _is_valid(entry_path):
+        manifest_path = os.path.join(entry_path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        try:
+            fasta_stat = os.stat(os.path.join(entry_path, 'proteins.fasta'))
+        except FileNotFoundError:
+            fasta_stat = None
+        if fasta_stat is None or [fasta_stat.st_size, fasta_stat.st_mtime_ns] != \
+                [manifest.get('size'), manifest.get('mtime_ns')]:
+            logging.warning(f"Genome cache entry {entry_path} is corrupt, replacing it")
+            return None
+        return manifest['sha1']
+
+    def open(self, upa, fetch_fasta):
+        """Returns the entry for a genome, calling fetch_fasta for its FASTA path on a miss"""
+        entry_path = self._entry_path(upa)
+        lock_file = open(entry_path + '.lock', 'a')
+        try:
+            # the use lock is taken before the entry is checked and never released in between,
+            # so it can't be evicted after it's found valid
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            with _flock(entry_path + '.fill.lock'):
+                sha1 = self._is_valid(entry_path)
+                if sha1:
+                    logging.info(f"Genome cache hit for {upa}")
+                else:
+                    logging.info(f"Genome cache miss for {upa}")
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                    sha1 = self._fill(entry_path, upa, fetch_fasta())
+                # the manifest's mtime records when the entry was last used
+                os.utime(os.path.join(entry_path, 'manifest.json'))
+        except Exception:
+            lock_file.close()
+            raise
+        self._evict()
+        return GenomeCacheEntry(entry_path, lock_file, sha1)
+
+    def _fill(self, entry_path, upa, fasta_path):
+        """Copies a genome's FASTA into a new entry and returns its SHA-1"""
+        tmp_path = os.path.join(self.cache_dir, f'.tmp-{uuid.uuid4()}')
+        os.makedirs(tmp_path)
+        tmp_fasta = os.path.join(tmp_path, 'proteins.fasta')
+        shutil.copyfile(fasta_path, tmp_fasta)
+        sha1 = _file_sha1(tmp_fasta)
+        # renaming the directory keeps the FASTA's size and modification time
+        fasta_stat = os.stat(tmp_fasta)
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as manifest_file:
+            json.dump({'ref': upa, 'sha1': sha1, 'size': fasta_stat.st_size,
+                       'mtime_ns': fasta_stat.st_mtime_ns}, manifest_file)
+        os.rename(tmp_path, entry_path)
+        return sha1
+
+    def _evict(self):
+        """Removes the least recently used entries that aren't open until the cache fits"""
+        with _flock(os.path.join(self.cache_dir, '.evict.lock')):
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if os.path.isdir(path) and not name.startswith('.'):
+                    manifest_path = os.path.join(path, 'manifest.json')
+                    last_used = os.path.getmtime(manifest_path) \
+                        if os.path.exists(manifest_path) else 0
+                    entries.append((last_used, path, _dir_size(path)))
+            total = sum(size for _, _, size in entries)
+            for _, path, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with open(path + '.lock', 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    shutil.rmtree(path, ignore_errors=True)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                total -= size
+                logging.info(f"Evicted {path} from the genome cache")
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+
+
+class HitCache:
+    """Persistent cache of alignment rows keyed by query set, genome and search parameters
+
+    Rows are stored as zlib compressed TSV in a SQLite database. When the stored rows grow past
+    max_bytes the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 'hits.sqlite')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS hits '
+                         '(key TEXT PRIMARY KEY, rows BLOB, size INTEGER, last_used REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS hits_last_used ON hits (last_used)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    @staticmethod
+    def key(query_hashes, genome_hash, params):
+        """Returns the cache key for a set of query sequence hashes against a genome"""
+        key_hash = hashlib.sha1()
+        for query_hash in sorted(query_hashes):
+            key_hash.update(query_hash.encode())
+        key_hash.update(genome_hash.encode())
+        key_hash.update(json.dumps(params, sort_keys=True).encode())
+        return key_hash.hexdigest()
+
+    def get(self, key):
+        """Returns the cached rows for a key or None if they aren't cached"""
+        with closing(self._connect()) as conn, conn:
+            result = conn.execute('SELECT rows FROM hits WHERE key = ?', (key,)).fetchone()
+            if result:
+                conn.execute('UPDATE hits SET last_used = ? WHERE key = ?', (time.time(), key))
+        with self._lock:
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+            logging.info(f"Alignment cache {'hit' if result else 'miss'} for {key} "
+                         f"({self.hits} hits, {self.misses} misses)")
+        if not result:
+            return None
+        text = zlib.decompress(result[0]).decode()
+        return [line.split('\t') for line in text.split('\n') if line]
+
+    def put(self, key, rows):
+        """Stores the rows for a key, evicting the least recently used entries to fit"""
+        self._store(key, zlib.compress("\n".join("\t".join(row) for row in rows).encode()))
+
+    def tee(self, key, rows):
+        """Yields rows as they arrive, storing them for key once they have all passed through
+
+        Rows are compressed as they go by rather than collected, and nothing is stored if the
+        iteration fails or stops early.
+        """
+        compressor = zlib.compressobj()
+        chunks = []
+        for row in rows:
+            chunks.append(compressor.compress(("\t".join(row) + "\n").encode()))
+            yield row
+        chunks.append(compressor.flush())
+        self._store(key, b"".join(chunks))
+
+    def _store(self, key, blob):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)',
+                         (key, blob, len(blob), time.time()))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM hits').fetchone()[0]
+            evicted = 0
+            for old_key, size in conn.execute('SELECT key, size FROM hits '
+                                              'ORDER BY last_used').fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM hits WHERE key = ?', (old_key,))
+                total -= size
+                evicted += 1
+            if evicted:
+                logging.info(f"Evicted {evicted} entries from the alignment cache")
@@ -0,0 +1,87 @@
+import numpy as np
+
+from kb_reaction_gene_finder.core.aligners import ALIGNMENT_COLS
+
+
+def hit_dtype(widths=None):
+    """Returns the dtype of a hit table with string columns of the given widths
+
+    The alignment columns are kept as the aligner's strings so reported values are unchanged,
+    in fixed-width unicode fields so sorting and grouping them runs in NumPy rather than
+    comparing Python objects; score holds the bit score as a number for filtering and ranking.
+    """
+    widths = widths or {}
+    return np.dtype([(col, f'U{max(1, widths.get(col, 1))}') for col in ALIGNMENT_COLS] +
+                    [('score', np.float64)])
+
+
+def _width(column):
+    return column.dtype.itemsize // np.dtype('U1').itemsize
+
+
+def _to_columns(rows):
+    columns = np.array(rows, dtype=str).reshape(len(rows), len(ALIGNMENT_COLS))
+    return [columns[:, i] for i in range(len(ALIGNMENT_COLS))]
+
+
+def from_rows(rows, chunk_size=100000):
+    """Loads alignment rows into a structured array, converting a chunk at a time"""
+    chunks, chunk = [], []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            chunks.append(_to_columns(chunk))
+            chunk = []
+    if chunk:
+        chunks.append(_to_columns(chunk))
+    widths = {col: max((_width(columns[i]) for columns in chunks), default=1)
+              for i, col in enumerate(ALIGNMENT_COLS)}
+    table = np.empty(sum(len(columns[0]) for columns in chunks), dtype=hit_dtype(widths))
+    start = 0
+    for columns in chunks:
+        end = start + len(columns[0])
+        for col, column in zip(ALIGNMENT_COLS, columns):
+            table[col][start:end] = column
+        start = end
+    table['score'] = table['bitscore'].astype(np.float64)
+    return table
+
+
+def fan_out(table, gene_hashes):
+    """Returns the rows for each (gene key, query hash) pair, relabelled with the gene key
+
+    Rows keep the order they have in table, grouped in the order of gene_hashes.
+    """
+    order = np.argsort(table['qseqid'], kind='stable')
+    hashes, starts, counts = np.unique(table['qseqid'][order], return_index=True,
+                                       return_counts=True)
+    rows_by_hash = {seq_hash: order[start:start + count]
+                    for seq_hash, start, count in zip(hashes, starts, counts)}
+    indices = [rows_by_hash.get(seq_hash, order[:0]) for _, seq_hash in gene_hashes]
+    if not indices:
+        return table[:0]
+    keys = np.array([key for key, _ in gene_hashes], dtype=str)
+    widths = {col: _width(table[col]) for col in ALIGNMENT_COLS}
+    widths['qseqid'] = max(widths['qseqid'], _width(keys))
+    gene_table = table[np.concatenate(indices)].astype(hit_dtype(widths))
+    gene_table['qseqid'] = np.repeat(keys, [len(idx) for idx in indices])
+    return gene_table
+
+
+def rank_hits(table, noise_level, number_to_report):
+    """Returns the best row and the hit count of the top scoring genome genes
+
+    Rows scoring below noise_level are dropped. Each genome gene is represented by its first
+    row with the highest score, and genes with equal scores keep the order they first appear.
+    """
+    passing = table[table['score'] >= noise_level]
+    if not len(passing):
+        return passing, np.zeros(0, dtype=np.int64)
+    _, first_seen, gene_idx, counts = np.unique(passing['sseqid'], return_index=True,
+                                                return_inverse=True, return_counts=True)
+    gene_idx = gene_idx.ravel()
+    # lexsort is stable, so rows of a gene with equal scores stay in table order
+    order = np.lexsort((-passing['score'], gene_idx))
+    best = order[np.concatenate(([0], np.flatnonzero(np.diff(gene_idx[order])) + 1))]
+    top = np.lexsort((first_seen, -passing['score'][best]))[:number_to_report]
+    return passing[best[top]], counts[top]
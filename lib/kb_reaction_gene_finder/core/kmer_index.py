@@ -0,0 +1,100 @@
+import numpy as np
+
+from kb_reaction_gene_finder.core.aligners import AMINO_ACIDS, encode
+
+# the longest k-mer whose code fits in an int64
+MAX_K = int(np.log(np.iinfo(np.int64).max) / np.log(len(AMINO_ACIDS)))
+
+# the recall check reports what fraction of real hits each of these thresholds would keep
+RECALL_THRESHOLDS = (1, 2, 3, 4, 5, 8, 10, 15, 20, 30)
+
+
+def kmer_codes(residues, k):
+    """Returns the distinct k-mers of an encoded protein as integers"""
+    if len(residues) < k:
+        return np.empty(0, dtype=np.int64)
+    codes = np.zeros(len(residues) - k + 1, dtype=np.int64)
+    for offset in range(k):
+        codes = codes * len(AMINO_ACIDS) + residues[offset:len(residues) - k + 1 + offset]
+    return np.unique(codes)
+
+
+class KmerIndex:
+    """Inverted index from the k-mers of a genome's proteins to the proteins that contain them
+
+    The index is three flat arrays in CSR layout: the sorted distinct k-mer codes, the offset
+    of each code's postings and the protein indices in those postings.
+    """
+    def __init__(self, codes, offsets, postings, protein_count, k):
+        self.codes = codes
+        self.offsets = offsets
+        self.postings = postings
+        self.protein_count = protein_count
+        self.k = k
+
+    @classmethod
+    def build(cls, proteins, k=3):
+        """Builds the index from a list of encoded proteins"""
+        protein_codes = [kmer_codes(protein, k) for protein in proteins]
+        all_codes = np.concatenate(protein_codes) if protein_codes else np.empty(0, np.int64)
+        proteins_idx = np.repeat(np.arange(len(proteins), dtype=np.int32),
+                                 [len(codes) for codes in protein_codes])
+        order = np.argsort(all_codes, kind='stable')
+        codes, counts = np.unique(all_codes[order], return_counts=True)
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(codes, offsets, proteins_idx[order], len(proteins), k)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as arrays:
+            return cls(arrays['codes'], arrays['offsets'], arrays['postings'],
+                       int(arrays['protein_count']), int(arrays['k']))
+
+    def save(self, file_path):
+        np.savez(file_path, codes=self.codes, offsets=self.offsets, postings=self.postings,
+                 protein_count=self.protein_count, k=self.k)
+
+    def shared_kmers(self, sequence):
+        """Returns the number of distinct k-mers each genome protein shares with a sequence"""
+        query_codes = kmer_codes(encode(sequence), self.k)
+        idx = np.searchsorted(self.codes, query_codes)
+        found = idx < len(self.codes)
+        found[found] = self.codes[idx[found]] == query_codes[found]
+        idx = idx[found]
+        starts, ends = self.offsets[idx], self.offsets[idx + 1]
+        lengths = ends - starts
+        # expand each matched code's [start, end) posting range without a Python loop
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+            np.arange(lengths.sum())
+        return np.bincount(self.postings[positions], minlength=self.protein_count)
+
+    def candidates(self, sequences, min_shared):
+        """Returns the indices of genome proteins sharing min_shared k-mers with any sequence"""
+        keep = np.zeros(self.protein_count, dtype=bool)
+        for seq in sequences:
+            if seq['sequence']:
+                keep |= self.shared_kmers(seq['sequence']) >= min_shared
+        return np.flatnonzero(keep)
+
+    def recall(self, sequences, rows, protein_ids, min_bitscore):
+        """Returns the fraction of alignment rows above min_bitscore kept at each threshold
+
+        rows are full, unfiltered search results; a row is kept at a threshold if its query
+        and genome protein share at least that many k-mers.
+        """
+        sequence_by_key = {seq['key']: seq['sequence'] for seq in sequences}
+        protein_idx = {protein_id: i for i, protein_id in enumerate(protein_ids)}
+        shared = {}
+        pair_shared = []
+        for row in rows:
+            if float(row[2]) < min_bitscore or row[0] not in protein_idx:
+                continue
+            if row[1] not in shared:
+                shared[row[1]] = self.shared_kmers(sequence_by_key[row[1]])
+            pair_shared.append(shared[row[1]][protein_idx[row[0]]])
+        pair_shared = np.array(pair_shared, dtype=np.int64)
+        if not len(pair_shared):
+            return {}
+        return {threshold: float(np.mean(pair_shared >= threshold))
+                for threshold in RECALL_THRESHOLDS}
@@ -0,0 +1,79 @@
+import logging
+import resource
+import threading
+import tracemalloc
+
+
+class MemoryProfiler:
+    """Takes tracemalloc snapshots and the peak RSS at each stage of a run
+
+    Each mark records the traced and peak traced memory, the process's peak RSS and the
+    allocations that grew most since the previous mark, so a summary shows which stage, and
+    which lines of code, the memory went to. A profiler that isn't enabled does nothing.
+
+    Reactions searched one at a time can be marked at each of their own stages too. Reactions
+    searched concurrently share the heap, so the growth between marks can't be attributed to
+    any one of them and only the run's stages should be marked.
+    """
+    def __init__(self, enabled=False, top=10, frames=1):
+        self.enabled = enabled
+        self.top = top
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._marks = []
+        self._previous = None
+        self._largest = None
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.mark('start')
+
+    def mark(self, stage):
+        if not self.enabled:
+            return
+        with self._lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                 tracemalloc.Filter(False, '<unknown>'),
+                 tracemalloc.Filter(False, tracemalloc.__file__)])
+            traced, peak = tracemalloc.get_traced_memory()
+            # ru_maxrss is in kilobytes on Linux
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            growth = []
+            if self._previous is not None:
+                growth = [stat for stat in snapshot.compare_to(self._previous, 'lineno')
+                          if stat.size_diff > 0][:self.top]
+            self._marks.append((stage, traced, peak, rss, growth))
+            logging.info(f"Memory at {stage}: {traced / 2**20:.1f} MB traced, "
+                         f"{peak / 2**20:.1f} MB traced peak, {rss / 2**20:.1f} MB peak RSS")
+            if self._largest is None or traced > self._largest[1]:
+                self._largest = (stage, traced, snapshot)
+            self._previous = snapshot
+
+    def summary(self):
+        """Returns a text summary of every mark and the top allocations"""
+        lines = [f"{'stage':<48} {'traced MB':>10} {'peak MB':>10} {'RSS MB':>10}"]
+        lines += [f"{stage:<48} {traced / 2**20:>10.1f} {peak / 2**20:>10.1f} {rss / 2**20:>10.1f}"
+                  for stage, traced, peak, rss, _ in self._marks]
+        for stage, _, _, _, growth in self._marks:
+            if growth:
+                lines.append(f"\nLargest growth up to {stage}:")
+                lines += [f"  {stat}" for stat in growth]
+        if self._largest is not None:
+            stage, traced, snapshot = self._largest
+            lines.append(f"\nTop allocations at {stage}, the most traced memory "
+                         f"({traced / 2**20:.1f} MB):")
+            lines += [f"  {stat}" for stat in snapshot.statistics('lineno')[:self.top]]
+        return "\n".join(lines)
+
+    def write_summary(self, path):
+        """Writes the summary to path and the log and stops tracing"""
+        if not self.enabled:
+            return
+        with self._lock:
+            summary = self.summary()
+        with open(path, 'w') as outfile:
+            outfile.write(summary + "\n")
+        logging.info(f"Memory profile, also written to {path}:\n{summary}")
+        tracemalloc.stop()
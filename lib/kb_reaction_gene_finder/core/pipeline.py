@@ -0,0 +1,73 @@
+import queue
+import threading
+from collections import deque
+
+_DONE = object()
+
+
+class Prefetcher:
+    """Iterates over an iterable in a background thread, staying up to depth items ahead
+
+    The thread starts as soon as the Prefetcher is created so the producer's work overlaps
+    with whatever the caller does before consuming it. Items come out in the iterable's order
+    and an exception in the producer is raised to the consumer when it reaches that point.
+    """
+    def __init__(self, iterable, depth):
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # time out regularly so a consumer that stopped early can't leave the thread blocked
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put((item, None)):
+                    return
+        except Exception as error:
+            self._put((_DONE, error))
+            return
+        self._put((_DONE, None))
+
+    def __iter__(self):
+        try:
+            while True:
+                item, error = self._queue.get()
+                if error is not None:
+                    raise error
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self._stop.set()
+
+    def close(self):
+        self._stop.set()
+
+
+def ordered_map(executor, fn, iterable, max_pending):
+    """Yields fn(item) for each item, in order, with up to max_pending calls in flight
+
+    Unlike executor.map, the iterable is consumed lazily so it can be a stream and no more than
+    max_pending results are held waiting for earlier ones.
+    """
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,40 @@
+import hashlib
+import logging
+from collections import OrderedDict
+
+
+def sequence_hash(sequence):
+    """Returns the SHA-1 content hash used to identify a protein sequence"""
+    return hashlib.sha1(sequence.encode()).hexdigest()
+
+
+class QuerySet:
+    """Collapses byte-identical protein sequences so each is only aligned once
+
+    Sequences are identified by their content hash, which is also used as the query ID in the
+    FASTA file. Callers keep the (gene key, hash) pairs returned by add() to fan the alignment
+    results back out to every original gene.
+    """
+    def __init__(self):
+        self.sequences = OrderedDict()
+        self.gene_count = 0
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def add(self, genes):
+        """Adds RE gene records and returns (gene key, sequence hash) for those with sequences"""
+        gene_hashes = []
+        for gene in genes:
+            if not gene.get('sequence'):
+                continue
+            seq_hash = sequence_hash(gene['sequence'])
+            self.sequences.setdefault(seq_hash, gene['sequence'])
+            gene_hashes.append((gene['key'], seq_hash))
+        self.gene_count += len(gene_hashes)
+        return gene_hashes
+
+    def records(self):
+        """Returns the unique sequences in the key/sequence form used for FASTA output"""
+        logging.info(f"Collapsed {self.gene_count} gene sequences to {len(self)} unique sequences")
+        return [{'key': seq_hash, 'sequence': seq} for seq_hash, seq in self.sequences.items()]
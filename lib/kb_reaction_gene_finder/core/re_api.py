@@ -1,20 +1,229 @@
 import json
 import logging
+import random
+import threading
+import time
+from contextlib import closing
 from pprint import pformat
 
+import ijson
 import requests
+from requests.adapters import HTTPAdapter
+
+from kb_reaction_gene_finder.core.timings import Timings
+
+
+def _cap_timeout(timeout, remaining):
+    """Shortens a requests timeout, a number or (connect, read) pair, to at most remaining"""
+    if isinstance(timeout, (tuple, list)):
+        return tuple(min(part, remaining) for part in timeout)
+    return min(timeout, remaining)
+
+
+class _CountingReader:
+    """File-like wrapper counting the bytes read through it"""
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.size += len(chunk)
+        return chunk
+
+
+def summarize_results(results):
+    """Describes a related sequences result by its size rather than its contents"""
+    genes = results.get('genes') or []
+    return (f"RE found {len(results.get('rxns') or [])} similar reactions, "
+            f"{len(results.get('rxn_gene_links') or [])} reaction gene links and {len(genes)} "
+            f"genes with {sum(len(gene.get('sequence') or '') for gene in genes)} residues")
+
+
+def gene_reaction_index(rxn_gene_links):
+    """Maps each gene ID in RE rxn_gene_links to the keys of the reactions it's linked to"""
+    index = {}
+    for links in rxn_gene_links:
+        rxn_key = links['rxn_id'].split('/')[1]
+        for gene in dict.fromkeys(links['linked_gene_ids']):
+            index.setdefault(gene, []).append(rxn_key)
+    return index
+
+
+def split_batch_results(batch_results):
+    """Splits a batched RE result into the single reaction results, in query order
+
+    Each reaction gets the rows of the shared genes table for the genes linked to it, in the
+    same shape a single reaction query returns.
+    """
+    genes = {gene['key']: gene for gene in batch_results['genes']}
+    results = []
+    for rxn_results in batch_results['reactions']:
+        gene_ids = dict.fromkeys(gene for links in rxn_results['rxn_gene_links']
+                                 for gene in links['linked_gene_ids'])
+        results.append({
+            'rxns': rxn_results['rxns'],
+            'rxn_gene_links': rxn_results['rxn_gene_links'],
+            'genes': [gene for key, gene in genes.items() if key in gene_ids],
+            'missing_genes': [gene for gene in gene_ids if gene not in genes]})
+    return results
+
+
+class CircuitBreaker:
+    """Fails relation engine calls fast once enough consecutive attempts have failed
+
+    After reset_timeout seconds calls are let through again; the first success closes the
+    breaker and another failure opens it for another reset_timeout.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.opened_at is not None and \
+                    time.monotonic() - self.opened_at < self.reset_timeout:
+                raise RuntimeError(f"Relation engine calls failed {self.failures} times in a "
+                                   f"row, not retrying for {self.reset_timeout} seconds")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Relation engine circuit breaker opened after "
+                                  f"{self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
 
 
 class RE_API:
-    def __init__(self, re_url, token):
+    """Relation engine client that keeps connections to RE open between queries
+
+    Each thread gets its own Session, since Sessions aren't thread safe, but they all share one
+    adapter so the keep-alive connections are pooled across threads. pool_size caps the open
+    connections and timeout is the (connect, read) timeout in seconds for each query. If cache
+    is an RECache, related sequence queries are answered from it when possible. If
+    sequence_store is a SequenceStore, batched queries only fetch the reaction and gene topology
+    and gene sequences come from the store, with a second query for any genes it doesn't have.
+    Single reaction queries always use the stored view, which includes the sequences.
+
+    Failed queries are retried up to retries times with exponential backoff and full jitter
+    starting from backoff seconds, as long as the call is within deadline seconds of starting.
+    breaker is shared by every call so a relation engine outage fails the job quickly.
+    Query times, retries, bytes received and cache hits are recorded in timings.
+    """
+    def __init__(self, re_url, token, pool_size=10, timeout=(10, 300), cache=None,
+                 retries=2, backoff=1, deadline=600, breaker=None, sequence_store=None,
+                 timings=None):
         self.re_url = re_url
         self.token = token
+        self.timeout = timeout
+        self.cache = cache
+        self.sequence_store = sequence_store
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.timings = timings or Timings()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            session = requests.Session()
+            session.headers['Authorization'] = self.token
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return self._local.session
+
+    def _call_re(self, endpoint="/api/v1/query_results/", params=None, data=None, timeout=None):
+        """Posts a query to RE, retrying failures, and returns the decoded response"""
+        logging.info(f"Calling RE_API{' view ' + params['view'] if params else ''} with "
+                     f"{len(data or '')} bytes of query data")
+        logging.debug(f"RE_API query data: {pformat(data)}")
+        timeout = timeout or self.timeout
+        with self.timings.span('re_query'):
+            ret, attempt, size = self._call_re_with_retries(endpoint, params, data, timeout)
+        self.timings.count('re_queries')
+        self.timings.count('re_retries', attempt)
+        self.timings.count('re_bytes', size)
+        return ret
+
+    def _call_re_with_retries(self, endpoint, params, data, timeout):
+        """Returns the decoded response, the number of retries made and the response size"""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self.breaker.check()
+            remaining = self.deadline - (time.monotonic() - start)
+            attempt_start = time.monotonic()
+            try:
+                ret, size = self._post(endpoint, params, data, _cap_timeout(timeout, remaining))
+                if "error" in ret:
+                    raise RuntimeError(f"{ret['error']}: {ret.get('arango_message', '')}")
+            except (requests.RequestException, ijson.JSONError, ValueError,
+                    RuntimeError) as error:
+                self.breaker.record_failure()
+                elapsed = time.monotonic() - start
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logging.warning(f"RE query attempt {attempt + 1} failed after "
+                                f"{time.monotonic() - attempt_start:.2f} seconds: {error}")
+                if attempt >= self.retries or elapsed + delay >= self.deadline:
+                    raise RuntimeError(f"RE query failed after {attempt + 1} attempts and "
+                                       f"{elapsed:.2f} seconds: {error}") from error
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            logging.info(f"RE query took {time.monotonic() - start:.2f} seconds "
+                         f"with {attempt} retries and returned {size / 2**20:.2f} MB")
+            return ret, attempt, size
 
-    def _call_re(self, endpoint="/api/v1/query_results/", params=None, data=None):
-        header = {"Authorization": self.token}
-        logging.info(f"Calling RE_API with query data: {pformat(data)}")
-        ret = requests.post(self.re_url+endpoint, data, params=params, headers=header)
-        return ret.json()
+    def _post(self, endpoint, params, data, timeout):
+        """Posts a query and decodes the response as it arrives, returning it and its size
+
+        Decoding from the socket means the raw response body is never held in memory
+        alongside the decoded results.
+        """
+        with closing(self.session.post(self.re_url+endpoint, data, params=params,
+                                       timeout=timeout, stream=True)) as response:
+            response.raw.decode_content = True
+            body = _CountingReader(response.raw)
+            return next(ijson.items(body, '', use_float=True)), body.size
+
+    def page_collection(self, collection, fields, page_size=10000, timeout=None):
+        """Yields the documents of a collection a page at a time, in key order
+
+        fields is the AQL expression each document d is returned as and must include its key.
+        Each page is a query on the primary index for the keys after the last one of the
+        previous page, so no page relies on a cursor staying open. These are ad-hoc queries, so
+        the relation engine only runs them for admin tokens.
+        """
+        query = f"""
+        FOR d IN {collection}
+            FILTER d._key > @last_key
+            SORT d._key
+            LIMIT @count
+            RETURN {fields}
+        """
+        last_key = ''
+        while True:
+            docs = self._call_re(data=json.dumps({'last_key': last_key, 'count': page_size,
+                                                  'query': query}), timeout=timeout)['results']
+            if not docs:
+                return
+            yield docs
+            last_key = docs[-1]['key']
 
     def get_related_sequences_adhoc(self, rid, sf_sim=1, df_sim=1, exclude_self=False):
         query = """
@@ -71,21 +280,146 @@ class RE_API:
         body = json.dumps({'rid': rid, 'sf_sim': sf_sim, 'df_sim': df_sim,
                            'exclude_self': exclude_self, "query": query})
         ret = self._call_re(data=body)
-        if "error" in ret:
-            raise RuntimeError(f"{ret['error']}: {ret.get('arango_message', '')}")
         logging.info(f"Found {len(ret['results'][0]['genes'])} related sequences")
         return ret['results'][0]
 
-    def get_related_sequences(self, rid, sf_sim=1, df_sim=1, exclude_self=False, retries=2):
+    def get_related_sequences_batch(self, rids, sf_sim=1, df_sim=1, exclude_self=False,
+                                    timeout=None):
+        """Fetches the related sequences of several reactions in a single query
+
+        Returns a result per reaction, in rids order, in the same shape as get_related_sequences.
+        Genes shared by several reactions are only transferred once. This is an ad-hoc query, so
+        the relation engine only runs it for admin tokens.
+        """
+        query = """
+        WITH rxn_reaction
+        LET start = @exclude_self ? 1 : 0
+        LET reactions = (
+            FOR rid IN @rids
+                LET rxns = (
+                    FOR v, e IN start..1
+                        ANY rid rxn_similar_to_reaction
+                        OPTIONS {uniqueVertices: "global", bfs: true}
+                        FILTER !e || e.sf_similarity >= @sf_sim
+                        FILTER !e || e.df_similarity >= @df_sim
+                        RETURN {
+                            id: v._id,
+                            key: v._key,
+                            name: v.name,
+                            definition: v.definition,
+                            "structural similarity": e.sf_similarity,
+                            "difference similarity": e.df_similarity
+                        }
+                )
+                LET rxn_ids = rxns[*].id
+
+                LET rxn_gene_links = (
+                    FOR e in rxn_reaction_within_complex
+                        FILTER e._from in rxn_ids
+                        LET linked_gene_ids = FLATTEN(
+                            FOR c in rxn_gene_complex
+                               FILTER c._id == e._to
+                               RETURN c.genes
+                        )
+                        COLLECT rxn_id = e._from INTO groups KEEP linked_gene_ids
+                        RETURN {rxn_id: rxn_id,
+                                linked_gene_ids: UNIQUE(FLATTEN(groups[*].linked_gene_ids))}
+                )
+                RETURN {rid: rid, rxns: rxns, rxn_gene_links: rxn_gene_links}
+        )
+
+        LET gene_ids = UNIQUE(FLATTEN(reactions[*].rxn_gene_links[*].linked_gene_ids, 2))
+
+        LET genes = (
+            FOR g in ncbi_gene
+               FILTER g._key IN gene_ids
+               RETURN {
+                   key: g._key,
+                   product: g.product,
+                   function: CONCAT_SEPARATOR(', ', g.functions),
+                   sequence: @with_sequences ? g.protein_translation : null
+               }
+        )
+
+        RETURN {reactions: reactions, genes: genes}
+        """
+        rids = [rid if rid.startswith('rxn_reaction/') else 'rxn_reaction/' + rid
+                for rid in rids]
+        results = {}
+        if self.cache is not None:
+            for rid in rids:
+                cached = self.cache.get(rid, sf_sim, df_sim, exclude_self)
+                if cached is not None:
+                    results[rid] = cached
+                    self.timings.count('re_cache_hits')
+        missing = [rid for rid in dict.fromkeys(rids) if rid not in results]
+        if missing:
+            body = json.dumps({'rids': missing, 'sf_sim': sf_sim, 'df_sim': df_sim,
+                               'exclude_self': exclude_self,
+                               'with_sequences': self.sequence_store is None, "query": query})
+            ret = self._call_re(data=body, timeout=timeout)
+            logging.info(f"Found {len(ret['results'][0]['genes'])} related sequences for "
+                         f"{len(missing)} reactions")
+            if self.sequence_store is not None:
+                self._add_sequences(ret['results'][0]['genes'], timeout)
+            for rid, rxn_results in zip(missing, split_batch_results(ret['results'][0])):
+                if self.cache is not None:
+                    self.cache.put(rid, sf_sim, df_sim, exclude_self, rxn_results)
+                results[rid] = rxn_results
+        return [results[rid] for rid in rids]
+
+    def _add_sequences(self, genes, timeout=None):
+        """Fills in gene sequences from the sequence store, fetching any it doesn't have"""
+        keys = list(dict.fromkeys(gene['key'] for gene in genes))
+        sequences = self.sequence_store.get(keys)
+        missing = [key for key in keys if key not in sequences]
+        logging.info(f"Sequence store has {len(sequences)} of {len(keys)} gene sequences")
+        self.timings.count('sequence_store_hits', len(sequences))
+        if missing:
+            # only genes RE returned a translation for are stored, so none is lost for good
+            fetched = self.get_gene_sequences(missing, timeout)
+            self.sequence_store.put(fetched)
+            sequences.update(fetched)
+        for gene in genes:
+            gene['sequence'] = sequences.get(gene['key'])
+
+    def get_gene_sequences(self, keys, timeout=None):
+        """Returns {gene key: protein translation} for the ncbi_gene keys RE has a translation for
+
+        The genes come back as a single document so RE's cursor batching can't truncate them.
+        """
+        query = """
+        RETURN (
+            FOR g in ncbi_gene
+                FILTER g._key IN @keys
+                FILTER g.protein_translation != null
+                RETURN {key: g._key, sequence: g.protein_translation}
+        )
+        """
+        body = json.dumps({'keys': keys, "query": query})
+        ret = self._call_re(data=body, timeout=timeout)
+        sequences = {gene['key']: gene['sequence'] for gene in ret['results'][0]
+                     if gene['sequence']}
+        logging.info(f"Fetched {len(sequences)} of {len(keys)} gene sequences")
+        return sequences
+
+    def get_related_sequences(self, rid, sf_sim=1, df_sim=1, exclude_self=False, timeout=None):
         if not rid.startswith('rxn_reaction/'):
             rid = 'rxn_reaction/' + rid
+        if self.cache is None:
+            return self._fetch_related_sequences(rid, sf_sim, df_sim, exclude_self, timeout)
+        results = self.cache.get(rid, sf_sim, df_sim, exclude_self)
+        if results is None:
+            results = self._fetch_related_sequences(rid, sf_sim, df_sim, exclude_self, timeout)
+            self.cache.put(rid, sf_sim, df_sim, exclude_self, results)
+        else:
+            self.timings.count('re_cache_hits')
+        return results
+
+    def _fetch_related_sequences(self, rid, sf_sim, df_sim, exclude_self, timeout):
         body = json.dumps({'rid': rid, 'sf_sim': sf_sim, 'df_sim': df_sim,
                            'exclude_self': exclude_self})
-        ret = self._call_re(params={'view': "list_genes_for_similar_reactions"}, data=body)
-        logging.info(f"RE API result:\n{json.dumps(ret, indent=2)}")
-        if "error" in ret:
-            if retries:
-                logging.warning("Arango Query failed. Retrying")
-                return self.get_related_sequences(rid, sf_sim, df_sim, exclude_self, retries-1)
-            raise RuntimeError(f"{ret['error']}: {ret.get('arango_message', '')}")
+        ret = self._call_re(params={'view': "list_genes_for_similar_reactions"}, data=body,
+                            timeout=timeout)
+        logging.info(summarize_results(ret['results'][0]))
         return ret['results'][0]
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+
+
+def narrow_results(results, sf_sim, df_sim):
+    """Filters RE results fetched at lower similarity floors down to the given floors
+
+    Raising a floor only drops similar reactions, so the links and genes of the reactions
+    that remain are exactly what a query at the higher floors would return.
+    """
+    rxns = [rxn for rxn in results['rxns']
+            if rxn.get('structural similarity') is None
+            or (rxn['structural similarity'] >= sf_sim
+                and rxn['difference similarity'] >= df_sim)]
+    rxn_ids = {rxn['id'] for rxn in rxns}
+    rxn_gene_links = [links for links in results['rxn_gene_links']
+                      if links['rxn_id'] in rxn_ids]
+    gene_ids = {gene for links in rxn_gene_links for gene in links['linked_gene_ids']}
+    narrowed = dict(results, rxns=rxns, rxn_gene_links=rxn_gene_links,
+                    genes=[gene for gene in results['genes'] if gene['key'] in gene_ids])
+    if 'missing_genes' in results:
+        narrowed['missing_genes'] = [gene for gene in results['missing_genes']
+                                     if gene in gene_ids]
+    return narrowed
+
+
+class RECache:
+    """Persistent cache of relation engine results for related sequence queries
+
+    Results are stored as zlib compressed JSON in a SQLite database and expire ttl seconds
+    after they were fetched. A query can be answered from a result for the same reaction at
+    lower or equal similarity floors by filtering it locally.
+    """
+    def __init__(self, cache_dir, ttl):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 're.sqlite')
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(rid TEXT, exclude_self INTEGER, sf_sim REAL, df_sim REAL, '
+                         'results BLOB, fetched REAL, '
+                         'PRIMARY KEY (rid, exclude_self, sf_sim, df_sim))')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def get(self, rid, sf_sim, df_sim, exclude_self):
+        """Returns the cached results for a query or None if no cached result covers it"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM results WHERE fetched < ?', (time.time() - self.ttl,))
+            # the highest floors below the query's need the least filtering
+            result = conn.execute(
+                'SELECT sf_sim, df_sim, results FROM results '
+                'WHERE rid = ? AND exclude_self = ? AND sf_sim <= ? AND df_sim <= ? '
+                'ORDER BY sf_sim + df_sim DESC LIMIT 1',
+                (rid, int(exclude_self), sf_sim, df_sim)).fetchone()
+        with self._lock:
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+            logging.info(f"RE cache {'hit' if result else 'miss'} for {rid} "
+                         f"({self.hits} hits, {self.misses} misses)")
+        if not result:
+            return None
+        results = json.loads(zlib.decompress(result[2]))
+        if (result[0], result[1]) != (sf_sim, df_sim):
+            results = narrow_results(results, sf_sim, df_sim)
+        return results
+
+    def put(self, rid, sf_sim, df_sim, exclude_self, results):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                         (rid, int(exclude_self), sf_sim, df_sim,
+                          zlib.compress(json.dumps(results).encode()), time.time()))
@@ -0,0 +1,197 @@
+"""Offline snapshot of the relation engine collections used to find related sequences
+
+Export a snapshot with
+
+    python -m kb_reaction_gene_finder.core.re_snapshot <re-api url> <snapshot path>
+
+using the token in KB_AUTH_TOKEN, then set re-snapshot in deploy.cfg to answer queries from it.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from kb_reaction_gene_finder.core.re_api import RE_API, summarize_results
+
+# collection -> (table, AQL fields exported for each document)
+COLLECTIONS = {
+    'rxn_reaction': ('reactions', "{key: d._key, id: d._id, name: d.name, "
+                                  "definition: d.definition}"),
+    'rxn_similar_to_reaction': ('similar', "{key: d._key, from: d._from, to: d._to, "
+                                           "sf_sim: d.sf_similarity, df_sim: d.df_similarity}"),
+    'rxn_reaction_within_complex': ('rxn_complexes', "{key: d._key, from: d._from, to: d._to}"),
+    'rxn_gene_complex': ('complex_genes', "{key: d._key, id: d._id, genes: d.genes}"),
+    'ncbi_gene': ('genes', "{key: d._key, product: d.product, "
+                           "function: CONCAT_SEPARATOR(', ', d.functions), "
+                           "sequence: d.protein_translation}"),
+}
+
+SCHEMA = """
+CREATE TABLE reactions (id TEXT PRIMARY KEY, key TEXT, name TEXT, definition TEXT);
+CREATE TABLE similar (from_id TEXT, to_id TEXT, sf_sim REAL, df_sim REAL);
+CREATE TABLE rxn_complexes (rxn_id TEXT, complex_id TEXT);
+CREATE TABLE complex_genes (complex_id TEXT, gene TEXT);
+CREATE TABLE genes (key TEXT PRIMARY KEY, product TEXT, function TEXT, sequence TEXT);
+CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+# built after loading, which is much faster than maintaining them during the inserts
+INDEXES = """
+CREATE INDEX similar_from ON similar (from_id);
+CREATE INDEX similar_to ON similar (to_id);
+CREATE INDEX rxn_complexes_rxn ON rxn_complexes (rxn_id);
+CREATE INDEX complex_genes_complex ON complex_genes (complex_id);
+"""
+
+
+def _rows(table, doc):
+    """Returns the snapshot rows for an exported document"""
+    if table == 'reactions':
+        return [(doc['id'], doc['key'], doc['name'], doc['definition'])]
+    if table == 'similar':
+        return [(doc['from'], doc['to'], doc['sf_sim'], doc['df_sim'])]
+    if table == 'rxn_complexes':
+        return [(doc['from'], doc['to'])]
+    if table == 'complex_genes':
+        return [(doc['id'], gene) for gene in doc['genes'] or []]
+    return [(doc['key'], doc['product'], doc['function'], doc['sequence'])]
+
+
+def export_snapshot(re_api, snapshot_path, page_size=10000):
+    """Dumps the relation engine collections to a SQLite snapshot at snapshot_path
+
+    Collections are paged through with RE_API.page_collection. The snapshot is written next to
+    snapshot_path and moved into place once it's complete.
+    """
+    tmp_path = f'{snapshot_path}.tmp-{uuid.uuid4()}'
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        conn.executescript(SCHEMA)
+        for collection, (table, fields) in COLLECTIONS.items():
+            start = time.time()
+            count = 0
+            for docs in re_api.page_collection(collection, fields, page_size):
+                rows = [row for doc in docs for row in _rows(table, doc)]
+                if rows:
+                    conn.executemany(f'INSERT INTO {table} VALUES '
+                                     f'({", ".join("?" * len(rows[0]))})', rows)
+                count += len(docs)
+            conn.commit()
+            logging.info(f"Exported {count} {collection} documents in "
+                         f"{time.time() - start:.2f} seconds")
+        conn.executescript(INDEXES)
+        conn.execute('INSERT INTO metadata VALUES (?, ?)', ('exported', str(time.time())))
+        conn.commit()
+    os.replace(tmp_path, snapshot_path)
+
+
+class LocalRE:
+    """Answers related sequence queries from a snapshot made by export_snapshot
+
+    The methods match RE_API's so it can be used in its place; the results are the same as
+    those of the traversal in RE_API.get_related_sequences_adhoc.
+    """
+    def __init__(self, snapshot_path):
+        if not os.path.exists(snapshot_path):
+            raise ValueError(f"Relation engine snapshot {snapshot_path} does not exist")
+        self.snapshot_path = snapshot_path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # SQLite connections can't be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(f'file:{self.snapshot_path}?mode=ro', uri=True)
+        return self._local.conn
+
+    def _similar_reactions(self, rid, sf_sim, df_sim, exclude_self):
+        rxns = {}
+        if not exclude_self:
+            rxns[rid] = (None, None)
+        for neighbor, rxn_sf_sim, rxn_df_sim in self.conn.execute(
+                'SELECT to_id, sf_sim, df_sim FROM similar WHERE from_id = ? '
+                'UNION ALL SELECT from_id, sf_sim, df_sim FROM similar WHERE to_id = ?',
+                (rid, rid)):
+            # missing similarities never pass a floor, as in AQL
+            if neighbor not in rxns and neighbor != rid \
+                    and None not in (rxn_sf_sim, rxn_df_sim) \
+                    and rxn_sf_sim >= sf_sim and rxn_df_sim >= df_sim:
+                rxns[neighbor] = (rxn_sf_sim, rxn_df_sim)
+        results = []
+        for rxn_id, (rxn_sf_sim, rxn_df_sim) in rxns.items():
+            reaction = self.conn.execute('SELECT key, name, definition FROM reactions '
+                                         'WHERE id = ?', (rxn_id,)).fetchone()
+            if reaction:
+                results.append({'id': rxn_id, 'key': reaction[0], 'name': reaction[1],
+                                'definition': reaction[2],
+                                'structural similarity': rxn_sf_sim,
+                                'difference similarity': rxn_df_sim})
+        return results
+
+    def _gene_links(self, rxn_ids):
+        links = {}
+        for rxn_id in rxn_ids:
+            for complex_id, gene in self.conn.execute(
+                    'SELECT rxn_complexes.complex_id, complex_genes.gene FROM rxn_complexes '
+                    'LEFT JOIN complex_genes '
+                    'ON rxn_complexes.complex_id = complex_genes.complex_id '
+                    'WHERE rxn_complexes.rxn_id = ?', (rxn_id,)):
+                genes = links.setdefault(rxn_id, {})
+                if gene is not None:
+                    genes[gene] = None
+        # in rxn_id order, as the traversal's COLLECT returns them
+        return [{'rxn_id': rxn_id, 'linked_gene_ids': list(links[rxn_id])}
+                for rxn_id in sorted(links)]
+
+    def _genes(self, gene_ids):
+        genes = []
+        gene_ids = list(gene_ids)
+        for i in range(0, len(gene_ids), 500):
+            chunk = gene_ids[i:i + 500]
+            genes.extend({'key': key, 'product': product, 'function': function,
+                          'sequence': sequence}
+                         for key, product, function, sequence in self.conn.execute(
+                             'SELECT key, product, function, sequence FROM genes '
+                             f'WHERE key IN ({",".join("?" * len(chunk))}) ORDER BY rowid',
+                             chunk))
+        return genes
+
+    def get_related_sequences(self, rid, sf_sim=1, df_sim=1, exclude_self=False, timeout=None):
+        if not rid.startswith('rxn_reaction/'):
+            rid = 'rxn_reaction/' + rid
+        rxns = self._similar_reactions(rid, sf_sim, df_sim, exclude_self)
+        rxn_gene_links = self._gene_links(rxn['id'] for rxn in rxns)
+        gene_ids = dict.fromkeys(gene for links in rxn_gene_links
+                                 for gene in links['linked_gene_ids'])
+        genes = self._genes(gene_ids)
+        found = {gene['key'] for gene in genes}
+        results = {'rxns': rxns, 'rxn_gene_links': rxn_gene_links, 'genes': genes,
+                   'missing_genes': [gene for gene in gene_ids if gene not in found]}
+        logging.info(summarize_results(results))
+        return results
+
+    def get_related_sequences_batch(self, rids, sf_sim=1, df_sim=1, exclude_self=False,
+                                    timeout=None):
+        return [self.get_related_sequences(rid, sf_sim, df_sim, exclude_self) for rid in rids]
+
+    def get_gene_sequences(self, keys, timeout=None):
+        return {gene['key']: gene['sequence'] for gene in self._genes(keys) if gene['sequence']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('re_url', help="relation engine API URL")
+    parser.add_argument('snapshot_path', help="path of the SQLite snapshot to write")
+    parser.add_argument('--page-size', type=int, default=10000,
+                        help="documents fetched per query")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    export_snapshot(RE_API(args.re_url, os.environ['KB_AUTH_TOKEN']), args.snapshot_path,
+                    args.page_size)
+
+
+if __name__ == '__main__':
+    main()
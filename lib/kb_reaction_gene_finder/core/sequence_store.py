@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+
+from kb_reaction_gene_finder.core.query_set import sequence_hash
+
+
+class SequenceStore:
+    """Persistent content-addressed store of RE gene protein sequences
+
+    Each gene key maps to the hash of its sequence and each distinct sequence is stored once,
+    zlib compressed, so the many genes sharing a protein don't repeat it. Only genes with a
+    sequence are stored, so a gene RE didn't return is looked up again next time.
+    """
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 'sequences.sqlite')
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS genes (key TEXT PRIMARY KEY, hash TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS sequences '
+                         '(hash TEXT PRIMARY KEY, sequence BLOB)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def get(self, keys):
+        """Returns {gene key: sequence} for the stored genes among keys"""
+        sequences = {}
+        keys = list(keys)
+        with closing(self._connect()) as conn:
+            # stay under SQLite's limit on the number of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                sequences.update(
+                    (key, zlib.decompress(sequence).decode())
+                    for key, sequence in conn.execute(
+                        'SELECT genes.key, sequences.sequence FROM genes '
+                        'JOIN sequences ON genes.hash = sequences.hash '
+                        f'WHERE genes.key IN ({",".join("?" * len(chunk))})', chunk))
+        return sequences
+
+    def put(self, sequences):
+        """Stores a {gene key: sequence} mapping, skipping genes without a sequence"""
+        hashes = {key: sequence_hash(sequence) for key, sequence in sequences.items() if sequence}
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR IGNORE INTO sequences VALUES (?, ?)',
+                             ((hashes[key], zlib.compress(sequence.encode()))
+                              for key, sequence in sequences.items() if sequence))
+            conn.executemany('INSERT OR REPLACE INTO genes VALUES (?, ?)', hashes.items())
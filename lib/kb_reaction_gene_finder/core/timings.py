@@ -0,0 +1,71 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Timings:
+    """Seconds spent in each stage of a run and counts of the items processed
+
+    Spans and counts can be recorded from any thread. Each accumulates into the run's totals
+    and, when a reaction is given, that reaction's breakdown as well.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds = {}
+        self._calls = {}
+        self._counts = {}
+        self._reactions = {}
+        # per thread, the seconds of exclusive spans nested in each open span
+        self._local = threading.local()
+
+    def _reaction(self, reaction):
+        return self._reactions.setdefault(reaction, {'stage_seconds': {}, 'counts': {}})
+
+    @contextmanager
+    def span(self, stage, reaction=None, exclusive=False):
+        """Times the enclosed block as a span of stage
+
+        An exclusive span's time is left out of the spans enclosing it in the same thread, for
+        one-off work that would otherwise be charged to whichever span needed it first.
+        """
+        if not hasattr(self._local, 'excluded'):
+            self._local.excluded = []
+        excluded = self._local.excluded
+        excluded.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start - excluded.pop()
+            if exclusive:
+                for i in range(len(excluded)):
+                    excluded[i] += seconds
+            self.add(stage, seconds, reaction)
+
+    def add(self, stage, seconds, reaction=None):
+        with self._lock:
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+            if reaction is not None:
+                stage_seconds = self._reaction(reaction)['stage_seconds']
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1, reaction=None):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + int(n)
+            if reaction is not None:
+                counts = self._reaction(reaction)['counts']
+                counts[name] = counts.get(name, 0) + int(n)
+
+    def as_dict(self):
+        """Returns the timings as a runTimings structure"""
+        with self._lock:
+            return {'stage_seconds': {stage: round(seconds, 4)
+                                      for stage, seconds in self._seconds.items()},
+                    'stage_calls': dict(self._calls),
+                    'counts': dict(self._counts),
+                    'reactions': [{'reaction_id': reaction,
+                                   'stage_seconds': {stage: round(seconds, 4) for stage, seconds
+                                                     in breakdown['stage_seconds'].items()},
+                                   'counts': dict(breakdown['counts'])}
+                                  for reaction, breakdown in self._reactions.items()]}
@@ -60,7 +60,12 @@ matching uniref sequence mapped from the modelseed set
            "difference_similarity_floor" of Double, parameter
            "blast_score_floor" of Double, parameter
            "number_of_hits_to_report" of Long, parameter "feature_set_prefix"
-           of String
+           of String, parameter "batch_blast" of type "boolean" (A boolean -
+           0 for false, 1 for true. @range (0, 1)), parameter "max_workers"
+           of Long, parameter "kmer_min_shared" of Long, parameter
+           "kmer_recall_check" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "memory_profile" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1))
         :returns: instance of type "findGenesResults" -> structure: parameter
            "gene_hits" of list of type "GeneHits" -> structure: parameter
            "reaction_id" of String, parameter "smarts_id" of String,
@@ -69,7 +74,18 @@ matching uniref sequence mapped from the modelseed set
            of mapping from String to list of String, parameter
            "feature_set_refs" of list of type "obj_ref" (An X/Y/Z style
            reference @id ws), parameter "report_name" of String, parameter
-           "report_ref" of type "obj_ref" (An X/Y/Z style reference @id ws)
+           "report_ref" of type "obj_ref" (An X/Y/Z style reference @id ws),
+           parameter "timings" of type "runTimings" (Seconds spent in each
+           stage of a run, the number of times each ran and counts such as
+           the RE genes returned, missing genes, alignment rows and rows
+           above the score floor) -> structure: parameter "stage_seconds" of
+           mapping from String to Double, parameter "stage_calls" of mapping
+           from String to Long, parameter "counts" of mapping from String to
+           Long, parameter "reactions" of list of type "reactionTimings"
+           (Seconds spent in each stage and counts for one reaction searched
+           in this run) -> structure: parameter "reaction_id" of String,
+           parameter "stage_seconds" of mapping from String to Double,
+           parameter "counts" of mapping from String to Long
         """
         # ctx is the context object
         # return variables are: output
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import random
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from kb_reaction_gene_finder.core.aligners import (ALIGNMENT_COLS, BLOSUM62, K, LAMBDA, Aligner,
+                                                   BlastAligner, LocalAligner, encode,
+                                                   _format_bitscore)
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def random_protein(rng, length):
+    return ''.join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def mutate(rng, sequence, count):
+    residues = list(sequence)
+    for i in rng.sample(range(len(residues)), count):
+        residues[i] = rng.choice(AMINO_ACIDS.replace(residues[i], ''))
+    return ''.join(residues)
+
+
+class AlignersTest(unittest.TestCase):
+    """Tests the alignment backends on small generated genomes"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = random.Random(0)
+        self.proteins = {f'prot_{i}': random_protein(self.rng, 120) for i in range(8)}
+        self.genome_fasta = os.path.join(self.tmp_dir, 'genome.fasta')
+        with open(self.genome_fasta, 'w') as outfile:
+            for seq_id, sequence in self.proteins.items():
+                outfile.write(f'>{seq_id} a protein\n{sequence}\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_aligner_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Aligner(self.genome_fasta, self.tmp_dir)
+
+    def test_genome_read_lazily(self):
+        aligner = LocalAligner(os.path.join(self.tmp_dir, 'missing.fasta'), self.tmp_dir)
+        with self.assertRaises(FileNotFoundError):
+            list(aligner.align([{'key': 'q', 'sequence': 'MKV'}]))
+
+    def test_exact_match_row(self):
+        sequence = self.proteins['prot_3']
+        rows = list(LocalAligner(self.genome_fasta, self.tmp_dir).align(
+            [{'key': 'query', 'sequence': sequence}]))
+        row = dict(zip(ALIGNMENT_COLS, rows[0]))
+        score = sum(BLOSUM62[code, code] for code in encode(sequence))
+        self.assertEqual(row['sseqid'], 'prot_3')
+        self.assertEqual(row['qseqid'], 'query')
+        self.assertEqual(row['bitscore'], _format_bitscore((LAMBDA * score - np.log(K))
+                                                           / np.log(2)))
+        self.assertEqual((row['pident'], row['length'], row['mismatch']),
+                         ('100.000', str(len(sequence)), '0'))
+        self.assertTrue(all(float(row[2]) < float(rows[0][2]) / 4 for row in rows[1:]))
+
+    def test_subset_matches_full_search(self):
+        queries = [{'key': f'query_{i}', 'sequence': mutate(self.rng, sequence, 20)}
+                   for i, sequence in enumerate(self.proteins.values())]
+        aligner = LocalAligner(self.genome_fasta, self.tmp_dir)
+        full = list(aligner.align(queries))
+        subset = list(aligner.align(queries, subjects=[1, 4, 6]))
+        self.assertEqual(subset, [row for row in full
+                                  if row[0] in ('prot_1', 'prot_4', 'prot_6')])
+
+    def test_one_row_per_pair(self):
+        # blastp can report each copy of the domain as its own HSP; the local aligner reports
+        # only the best alignment of the pair
+        domain = self.proteins['prot_5']
+        query = domain + random_protein(self.rng, 40) + mutate(self.rng, domain, 10)
+        rows = list(LocalAligner(self.genome_fasta, self.tmp_dir).align(
+            [{'key': 'query', 'sequence': query}]))
+        self.assertEqual([row[0] for row in rows].count('prot_5'), 1)
+        self.assertEqual(rows[0][:1] + rows[0][3:6],
+                         ['prot_5', '100.000', str(len(domain)), '0'])
+
+    def test_blast_subset_restricts_database(self):
+        # stand-ins for the BLAST+ tools that record how blastp was called
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        os.mkdir(bin_dir)
+        calls = os.path.join(self.tmp_dir, 'calls.json')
+        for tool, script in (('makeblastdb', 'pass'),
+                             ('blastp', f"""
+args = sys.argv[1:]
+seqids = open(args[args.index('-seqidlist') + 1]).read().split()
+json.dump({{'args': args, 'seqids': seqids}}, open({calls!r}, 'w'))
+sys.stdin.read()""")):
+            with open(os.path.join(bin_dir, tool), 'w') as outfile:
+                outfile.write(f"#!{shutil.which('python3')}\nimport json, sys\n{script}\n")
+            os.chmod(os.path.join(bin_dir, tool), stat.S_IRWXU)
+        with mock.patch.dict(os.environ, {'PATH': f"{bin_dir}:{os.environ['PATH']}"}):
+            aligner = BlastAligner(self.genome_fasta, self.tmp_dir)
+            list(aligner.align([{'key': 'q', 'sequence': 'MKV'}], subjects=[2, 5]))
+        with open(calls) as infile:
+            call = json.load(infile)
+        self.assertEqual(call['seqids'], ['prot_2', 'prot_5'])
+        self.assertEqual(call['args'][call['args'].index('-db') + 1], aligner.db)
+        self.assertEqual(call['args'][call['args'].index('-dbsize') + 1],
+                         str(sum(len(sequence) for sequence in self.proteins.values())))
+        self.assertFalse([name for name in os.listdir(self.tmp_dir) if 'subset' in name])
+
+    @unittest.skipUnless(shutil.which('blastp') and shutil.which('makeblastdb'),
+                         "BLAST+ is not installed")
+    def test_parity_with_blastp(self):
+        queries = [{'key': f'query_{i}', 'sequence': mutate(self.rng, sequence, 12)}
+                   for i, sequence in enumerate(self.proteins.values())]
+        local_rows = list(LocalAligner(self.genome_fasta, self.tmp_dir).align(queries))
+        blast_rows = {}
+        for row in BlastAligner(self.genome_fasta, self.tmp_dir).align(queries):
+            # compare the best HSP of each pair, the one the local aligner reports
+            blast_rows.setdefault((row[0], row[1]), row)
+        for query, seq_id in zip(queries, self.proteins):
+            local = dict(zip(ALIGNMENT_COLS, next(row for row in local_rows
+                                                  if row[1] == query['key'])))
+            blast = dict(zip(ALIGNMENT_COLS, blast_rows[(seq_id, query['key'])]))
+            self.assertEqual(local['sseqid'], blast['sseqid'])
+            # blastp adjusts scores for composition, so they agree closely but not exactly
+            self.assertAlmostEqual(float(local['bitscore']), float(blast['bitscore']),
+                                   delta=0.15 * float(blast['bitscore']))
+            self.assertAlmostEqual(float(local['pident']), float(blast['pident']), delta=5)
+            self.assertAlmostEqual(int(local['length']), int(blast['length']), delta=5)
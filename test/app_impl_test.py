@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from kb_reaction_gene_finder.core.app_impl import AppImpl
+from kb_reaction_gene_finder.core.genome_aligner import GenomeAligner
+from kb_reaction_gene_finder.core.memory_profile import MemoryProfiler
+from re_stub_server import StubREServer
+
+
+class FakeWorkspace:
+    def __init__(self):
+        self.saves = []
+
+    def save_objects(self, params):
+        self.saves.append(params)
+        return [[i + 10, obj['name'], obj['type'], '', 1, '', 7, 'ws', '', 0, {}]
+                for i, obj in enumerate(params['objects'])]
+
+
+class Ctx(dict):
+    def provenance(self):
+        return [{'service': 'kb_reaction_gene_finder'}]
+
+
+class AppImplTest(unittest.TestCase):
+    """Tests parts of the app that don't need KBase services"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'SDK_CALLBACK_URL': 'http://localhost:1'}):
+            self.impl = AppImpl({'scratch': self.tmp_dir, 're-api': 'http://localhost:1',
+                                 'workspace-url': 'http://localhost:1'}, Ctx(token='token'))
+        self.impl.ws = FakeWorkspace()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_checkpoint_key(self):
+        params = {'workspace_name': 'ws', 'query_genome_ref': '1/2/3',
+                  'structural_similarity_floor': 0.5, 'kmer_min_shared': 3}
+        key = self.impl._checkpoint_key(['rxn00010'], params)
+        for changed in ({'max_workers': 4}, {'batch_blast': 1}, {'memory_profile': 1},
+                        {'blast_score_floor': 50}):
+            self.assertEqual(self.impl._checkpoint_key(['rxn00010'], dict(params, **changed)),
+                             key)
+        for changed in ({'query_genome_ref': '1/2/4'}, {'structural_similarity_floor': 0.6},
+                        {'kmer_min_shared': 4}, {'kmer_recall_check': 1},
+                        {'feature_set_prefix': 'other'}):
+            self.assertNotEqual(self.impl._checkpoint_key(['rxn00010'], dict(params, **changed)),
+                                key)
+        self.assertNotEqual(self.impl._checkpoint_key(['rxn00011'], params), key)
+
+    def test_pipeline_depth(self):
+        self.assertEqual(self.impl.pipeline_depth, 2 * self.impl.re_max_concurrency)
+
+    def test_kmer_size_validated(self):
+        for kmer_size in ('0', '14'):
+            with mock.patch.dict(os.environ, {'SDK_CALLBACK_URL': 'http://localhost:1'}):
+                with self.assertRaisesRegex(ValueError, 'kmer-size'):
+                    AppImpl({'scratch': self.tmp_dir, 're-api': 'http://localhost:1',
+                             'workspace-url': 'http://localhost:1', 'kmer-size': kmer_size},
+                            Ctx(token='token'))
+
+    def test_save_feature_sets(self):
+        refs = self.impl._save_feature_sets('ws', '1/2/3', 'candidates',
+                                            [('rxn00010', ['g1', 'g2']), ('rxn00011', ['g3'])])
+        self.assertEqual(refs, ['7/10/1', '7/11/1'])
+        self.assertEqual(len(self.impl.ws.saves), 1)
+        save = self.impl.ws.saves[0]
+        self.assertEqual(save['workspace'], 'ws')
+        self.assertEqual([obj['name'] for obj in save['objects']],
+                         ['candidates_rxn00010', 'candidates_rxn00011'])
+        first = save['objects'][0]
+        self.assertEqual(first['type'], 'KBaseCollections.FeatureSet')
+        self.assertEqual(first['data']['element_ordering'], ['g1', 'g2'])
+        self.assertEqual(first['data']['elements'], {'g1': ['1/2/3'], 'g2': ['1/2/3']})
+        self.assertIn('rxn00010', first['data']['description'])
+        self.assertEqual(first['provenance'], [{'service': 'kb_reaction_gene_finder'}])
+
+    def related_and_genome(self):
+        """Returns stub RE results for four reactions and a genome with hits for their genes"""
+        stub = StubREServer(similar_reactions=2, genes_per_reaction=5, gene_pool=40,
+                            sequence_length=60)
+        stub.httpd.server_close()
+        rng = random.Random(1)
+        genome_fasta = os.path.join(self.tmp_dir, 'genome.fasta')
+        with open(genome_fasta, 'w') as outfile:
+            # mutated copies of the RE genes so there are hits, and some unrelated proteins
+            for i in range(40):
+                sequence = list(stub.gene(f'gene_{i}')['sequence'])
+                for _ in range(6):
+                    sequence[rng.randrange(len(sequence))] = rng.choice('ACDEFGHIKLMNPQRSTVWY')
+                outfile.write(f">genome_{i}\n{''.join(sequence)}\n")
+            for i in range(20):
+                outfile.write(f">random_{i}\n"
+                              f"{''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(80))}\n")
+        reactions = ['rxnA', 'rxnB', 'rxnC', 'rxnD']
+        related = [self.impl._index_related_sequences(stub.related_sequences(rxn))
+                   for rxn in reactions]
+        return reactions, related, genome_fasta
+
+    def test_batched_matches_serial_with_prefilter(self):
+        reactions, related, genome_fasta = self.related_and_genome()
+        params = {'blast_score_floor': 15, 'number_of_hits_to_report': 10}
+        for kmer_min_shared in (2, 4):
+            def genome():
+                return GenomeAligner(genome_fasta, self.tmp_dir, local_max_cells=1e12,
+                                     kmer_min_shared=kmer_min_shared)
+            serial = [self.impl.find_genes_for_rxn(rxn, genome(), params, 1, results)
+                      for rxn, results in zip(reactions, related)]
+            batched = self.impl.find_genes_for_rxns_batched(reactions, genome(), params, 1,
+                                                            related)
+            self.assertEqual(batched, serial)
+            self.assertTrue(any(hits for hits, _, _ in serial))
+
+    def test_memory_marks(self):
+        reactions, related, genome_fasta = self.related_and_genome()
+        params = {'blast_score_floor': 15}
+        for max_workers, expected in ((1, [f'{rxn} {stage}' for rxn in reactions
+                                           for stage in ('re_results', 'alignment', 'html')]),
+                                      (2, [])):
+            self.impl.memory = MemoryProfiler(enabled=True)
+            self.impl.memory.start()
+            genome = GenomeAligner(genome_fasta, self.tmp_dir, local_max_cells=1e12)
+            with mock.patch('kb_reaction_gene_finder.core.app_impl._cpu_budget',
+                            return_value=2):
+                list(self.impl._search_reactions(reactions, iter(related), genome,
+                                                 dict(params, max_workers=max_workers)))
+            self.impl.memory.write_summary(os.path.join(self.tmp_dir, 'memory_profile.txt'))
+            # reactions searched one at a time are marked at each of their stages
+            stages = [line.split()[0] + ' ' + line.split()[1]
+                      for line in self.impl.memory.summary().splitlines()[2:]
+                      if line.startswith('rxn')]
+            self.assertEqual(stages, expected)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_reaction_gene_finder.core.checkpoint import Checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+    """Tests saving and resuming a run's per-reaction results"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_key(self):
+        params = {'query_genome_ref': '1/2/3', 'reaction_set': ['rxn00010', 'rxn00011']}
+        self.assertEqual(Checkpoint.key(params), Checkpoint.key(dict(reversed(params.items()))))
+        self.assertNotEqual(Checkpoint.key(params),
+                            Checkpoint.key(dict(params, query_genome_ref='1/2/4')))
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.load(['rxn00010', 'rxn00011']), {})
+        checkpoint.save(1, 'rxn00011', ([{'gene': 'g1'}], ['g1'], '<table></table>'))
+        done = Checkpoint(self.path).load(['rxn00010', 'rxn00011'])
+        self.assertEqual(done, {1: ([{'gene': 'g1'}], ['g1'], '<table></table>')})
+        # results saved for another reaction at the same position aren't reused
+        self.assertEqual(Checkpoint(self.path).load(['rxn00010', 'rxn00012']), {})
+        self.assertEqual(sorted(os.listdir(self.path)), ['1.json'])
+
+    def test_feature_set_refs(self):
+        checkpoint = Checkpoint(self.path)
+        self.assertIsNone(checkpoint.load_feature_set_refs())
+        checkpoint.save_feature_set_refs([])
+        self.assertEqual(Checkpoint(self.path).load_feature_set_refs(), [])
+
+    def test_clear(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.save(0, 'rxn00010', ([], [], ''))
+        checkpoint.save_feature_set_refs(['1/2/3'])
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.load(['rxn00010']), {})
+        self.assertIsNone(checkpoint.load_feature_set_refs())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from kb_reaction_gene_finder.core.genome_aligner import GenomeAligner
+from kb_reaction_gene_finder.core.timings import Timings
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def random_protein(rng, length):
+    return ''.join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+class GenomeAlignerTest(unittest.TestCase):
+    """Tests choosing, prefiltering and reusing searches of a genome"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = random.Random(0)
+        self.proteins = [random_protein(rng, 100) for _ in range(10)]
+        self.genome_fasta = os.path.join(self.tmp_dir, 'genome.fasta')
+        with open(self.genome_fasta, 'w') as outfile:
+            for i, sequence in enumerate(self.proteins):
+                outfile.write(f'>prot_{i}\n{sequence}\n')
+        self.queries = {key: {'key': key, 'sequence': sequence[10:90]}
+                        for key, sequence in zip('abcd', self.proteins)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def aligner(self, **kwargs):
+        return GenomeAligner(self.genome_fasta, self.tmp_dir, local_max_cells=1e9, **kwargs)
+
+    def search(self, aligner, keys):
+        return list(aligner.align([self.queries[key] for key in keys]))
+
+    def test_reuses_earlier_searches(self):
+        aligner = self.aligner()
+        self.search(aligner, 'ab')
+        with mock.patch.object(aligner.local, 'align', wraps=aligner.local.align) as align:
+            rows = self.search(aligner, 'bca')
+        self.assertEqual([seq['key'] for seq in align.call_args[0][0]], ['c'])
+        self.assertEqual(rows, self.search(self.aligner(), 'bca'))
+        self.assertEqual([row[1] for row in rows][:1], ['b'])
+
+    def test_stopped_search_not_remembered(self):
+        aligner = self.aligner()
+        rows = aligner.align([self.queries['a']])
+        next(rows)
+        rows.close()
+        self.assertEqual(self.search(aligner, 'a'), self.search(self.aligner(), 'a'))
+
+    def test_index_timed_apart(self):
+        timings = Timings()
+        aligner = self.aligner(kmer_min_shared=2, timings=timings)
+        with timings.span('alignment', 'rxn00010'):
+            self.search(aligner, 'ab')
+        # reading the proteins and building the k-mer index, in a stage of their own
+        self.assertEqual(timings.as_dict()['stage_calls']['genome_index'], 2)
+        self.search(aligner, 'c')
+        recorded = timings.as_dict()
+        self.assertEqual(recorded['stage_calls']['genome_index'], 2)
+        self.assertEqual(list(recorded['reactions'][0]['stage_seconds']), ['alignment'])
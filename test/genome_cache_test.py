@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from kb_reaction_gene_finder.core.genome_cache import GenomeCache
+
+
+class GenomeCacheTest(unittest.TestCase):
+    """Tests the genome cache's entries, locking and eviction"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.fetches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def fetch(self, upa, size=1000):
+        def fetch_fasta():
+            self.fetches.append(upa)
+            file_path = os.path.join(self.tmp_dir, f"{upa.replace('/', '_')}.fasta")
+            with open(file_path, 'w') as outfile:
+                outfile.write(f">{upa}\n{'M' * size}\n")
+            return file_path
+        return fetch_fasta
+
+    def test_hit_and_miss(self):
+        cache = GenomeCache(self.cache_dir, 2**20)
+        entry = cache.open('1/2/3', self.fetch('1/2/3'))
+        with open(entry.fasta) as infile:
+            self.assertEqual(infile.readline(), '>1/2/3\n')
+        sha1 = entry.sha1
+        entry.close()
+        entry = cache.open('1/2/3', self.fetch('1/2/3'))
+        self.assertEqual(entry.sha1, sha1)
+        entry.close()
+        self.assertEqual(self.fetches, ['1/2/3'])
+
+    def test_changed_fasta_is_replaced(self):
+        cache = GenomeCache(self.cache_dir, 2**20)
+        entry = cache.open('1/2/3', self.fetch('1/2/3'))
+        entry.close()
+        with open(entry.fasta, 'a') as outfile:
+            outfile.write('>truncated\n')
+        cache.open('1/2/3', self.fetch('1/2/3')).close()
+        self.assertEqual(self.fetches, ['1/2/3', '1/2/3'])
+
+    def test_derived(self):
+        cache = GenomeCache(self.cache_dir, 2**20)
+        entry = cache.open('1/2/3', self.fetch('1/2/3'))
+        builds = []
+
+        def build(path):
+            builds.append(path)
+            with open(path, 'w') as outfile:
+                outfile.write('index')
+        self.assertEqual(entry.derived('index', build), entry.derived('index', build))
+        self.assertEqual(len(builds), 1)
+        entry.close()
+
+    def test_open_entry_holds_use_lock(self):
+        cache = GenomeCache(self.cache_dir, 2**20)
+        entry = cache.open('1/2/3', self.fetch('1/2/3'))
+        with open(entry.path + '.lock', 'a') as lock_file:
+            with self.assertRaises(BlockingIOError):
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            entry.close()
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_evicts_least_recently_used_closed_entries(self):
+        cache = GenomeCache(self.cache_dir, 2500)
+        in_use = cache.open('1/1/1', self.fetch('1/1/1'))
+        time.sleep(0.01)
+        old = cache.open('1/2/1', self.fetch('1/2/1'))
+        old.close()
+        time.sleep(0.01)
+        new = cache.open('1/3/1', self.fetch('1/3/1'))
+        new.close()
+        # the oldest entry is open, so the next oldest goes instead
+        self.assertTrue(os.path.exists(in_use.fasta))
+        self.assertFalse(os.path.exists(old.path))
+        self.assertTrue(os.path.exists(new.fasta))
+        in_use.close()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+
+from kb_reaction_gene_finder.core.hit_cache import HitCache
+
+
+def make_rows(prefix, count):
+    return [[f'{prefix}_gene_{i}', f'{prefix}_query', '50.1', '90.000', '100', '10', '1e-20']
+            for i in range(count)]
+
+
+class HitCacheTest(unittest.TestCase):
+    """Tests the on-disk alignment row cache"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_get(self):
+        cache = HitCache(self.tmp_dir, 2**20)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', make_rows('a', 3))
+        self.assertEqual(cache.get('a'), make_rows('a', 3))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_key(self):
+        key = HitCache.key(['h1', 'h2'], 'genome', {'k': 3})
+        self.assertEqual(key, HitCache.key(['h2', 'h1'], 'genome', {'k': 3}))
+        self.assertNotEqual(key, HitCache.key(['h1', 'h2'], 'other genome', {'k': 3}))
+        self.assertNotEqual(key, HitCache.key(['h1', 'h2'], 'genome', {'k': 4}))
+
+    def test_tee(self):
+        cache = HitCache(self.tmp_dir, 2**20)
+        rows = make_rows('a', 5)
+        teed = cache.tee('a', iter(rows))
+        self.assertEqual(next(teed), rows[0])
+        # nothing is stored until every row has passed through
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual([rows[0]] + list(teed), rows)
+        self.assertEqual(cache.get('a'), rows)
+
+    def test_tee_stopped_early(self):
+        cache = HitCache(self.tmp_dir, 2**20)
+        teed = cache.tee('a', iter(make_rows('a', 5)))
+        next(teed)
+        teed.close()
+        self.assertIsNone(cache.get('a'))
+
+    def test_evicts_least_recently_used(self):
+        size = len(zlib.compress("\n".join("\t".join(row) for row in make_rows('a', 50))
+                                 .encode()))
+        cache = HitCache(self.tmp_dir, 2.5 * size)
+        for key in ('a', 'b'):
+            cache.put(key, make_rows(key, 50))
+            time.sleep(0.01)
+        cache.get('a')
+        time.sleep(0.01)
+        cache.put('c', make_rows('c', 50))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), make_rows('a', 50))
+        self.assertEqual(cache.get('c'), make_rows('c', 50))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from collections import Counter, OrderedDict
+
+from kb_reaction_gene_finder.core import hit_table
+from kb_reaction_gene_finder.core.aligners import ALIGNMENT_COLS
+
+
+def rank_with_counters(rows, noise_level, number_to_report):
+    """The ranking hit_table replaced, as it was written with OrderedDict and Counter"""
+    gene_hits = dict()
+    top_bitscore = Counter()
+    gene_hit_count = Counter()
+    for row in rows:
+        cols = OrderedDict(zip(ALIGNMENT_COLS, row))
+        bl_score = float(cols['bitscore'])
+        if bl_score < noise_level:
+            continue
+        gene_hit_count[cols['sseqid']] += 1
+        if cols['sseqid'] not in gene_hits or top_bitscore[cols['sseqid']] < bl_score:
+            gene_hits[cols['sseqid']] = cols
+            top_bitscore[cols['sseqid']] = bl_score
+    top_genes = [gene for gene, _ in top_bitscore.most_common(number_to_report)]
+    return [list(gene_hits[gene].values()) for gene in top_genes], \
+        [gene_hit_count[gene] for gene in top_genes]
+
+
+def random_rows(rng, count):
+    # few genes and coarse scores so there are plenty of ties
+    return [[f'genome_gene_{rng.randrange(12)}', f'db_gene_{rng.randrange(30)}',
+             str(rng.choice([30, 50, 50.5, 60, 75, 75, 90, 120])), f'{rng.uniform(20, 100):.3f}',
+             str(rng.randrange(50, 400)), str(rng.randrange(40)), f'{rng.random():.2e}']
+            for _ in range(count)]
+
+
+class HitTableTest(unittest.TestCase):
+    """Tests loading, fanning out and ranking alignment rows"""
+
+    def test_from_rows(self):
+        rows = random_rows(random.Random(0), 25)
+        table = hit_table.from_rows(iter(rows), chunk_size=7)
+        self.assertEqual([[str(row[col]) for col in ALIGNMENT_COLS] for row in table], rows)
+        self.assertEqual(list(table['score']), [float(row[2]) for row in rows])
+        self.assertEqual(table.dtype['sseqid'].kind, 'U')
+        self.assertEqual(len(hit_table.from_rows([])), 0)
+
+    def test_rank_matches_counters(self):
+        for seed in range(50):
+            rng = random.Random(seed)
+            rows = random_rows(rng, rng.randrange(0, 80))
+            noise_level, number_to_report = rng.choice([0, 50, 70]), rng.randrange(1, 8)
+            best, counts = hit_table.rank_hits(hit_table.from_rows(rows), noise_level,
+                                               number_to_report)
+            expected_rows, expected_counts = rank_with_counters(rows, noise_level,
+                                                                number_to_report)
+            self.assertEqual([[str(row[col]) for col in ALIGNMENT_COLS] for row in best],
+                             expected_rows)
+            self.assertEqual(counts.tolist(), expected_counts)
+
+    def test_fan_out(self):
+        rows = [['g1', 'hash_a', '60', '90', '100', '1', '1e-10'],
+                ['g2', 'hash_b', '70', '90', '100', '1', '1e-10'],
+                ['g3', 'hash_a', '80', '90', '100', '1', '1e-10']]
+        table = hit_table.from_rows(rows)
+        fanned = hit_table.fan_out(table, [('a_much_longer_gene_key', 'hash_a'),
+                                           ('b', 'hash_b'), ('c', 'hash_c')])
+        self.assertEqual(fanned['sseqid'].tolist(), ['g1', 'g3', 'g2'])
+        self.assertEqual(fanned['qseqid'].tolist(),
+                         ['a_much_longer_gene_key', 'a_much_longer_gene_key', 'b'])
+        self.assertEqual(len(hit_table.fan_out(table, [])), 0)
@@ -166,6 +166,18 @@ class kb_reaction_gene_finderTest(unittest.TestCase):
         ret = self.serviceImpl.find_genes_from_similar_reactions(self.ctx, inp)
         self.validateRetStruct(inp, ret)
 
+    def test_find_genes_from_similar_reactions_batch_blast(self):
+        inp = {'workspace_name': self.wsName,
+               'bulk_reaction_ids': 'rxn00371\nrxn00083\nrxn04632',
+               'query_genome_ref': 'ReferenceDataManager/GCF_002163935.1',
+               'number_of_hits_to_report': 10
+               }
+        ret = self.serviceImpl.find_genes_from_similar_reactions(self.ctx, dict(inp))
+        batch_ret = self.serviceImpl.find_genes_from_similar_reactions(
+            self.ctx, {**inp, 'batch_blast': 1})
+        self.validateRetStruct(inp, batch_ret)
+        self.assertEqual(ret[0]['gene_hits'], batch_ret[0]['gene_hits'])
+
     # return value checks
 
     """
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from kb_reaction_gene_finder.core.aligners import encode
+from kb_reaction_gene_finder.core.kmer_index import RECALL_THRESHOLDS, KmerIndex
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def kmers(sequence, k):
+    return {sequence[i:i + k] for i in range(len(sequence) - k + 1)}
+
+
+class KmerIndexTest(unittest.TestCase):
+    """Tests the k-mer prefilter against a brute force count of shared k-mers"""
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.proteins = [''.join(rng.choice(AMINO_ACIDS) for _ in range(rng.randrange(2, 60)))
+                         for _ in range(30)]
+        self.queries = [''.join(rng.choice(AMINO_ACIDS) for _ in range(40)) for _ in range(5)]
+        # a query that shares a stretch with one protein
+        self.queries.append(self.queries[0][:10] + self.proteins[7][5:25])
+        self.index = KmerIndex.build([encode(protein) for protein in self.proteins], k=3)
+
+    def test_shared_kmers(self):
+        for query in self.queries:
+            self.assertEqual(self.index.shared_kmers(query).tolist(),
+                             [len(kmers(query, 3) & kmers(protein, 3))
+                              for protein in self.proteins])
+
+    def test_candidates(self):
+        sequences = [{'key': str(i), 'sequence': query} for i, query in enumerate(self.queries)]
+        sequences.append({'key': 'empty', 'sequence': None})
+        for min_shared in (1, 3, 10):
+            expected = [i for i, protein in enumerate(self.proteins)
+                        if any(len(kmers(query, 3) & kmers(protein, 3)) >= min_shared
+                               for query in self.queries)]
+            self.assertEqual(self.index.candidates(sequences, min_shared).tolist(), expected)
+        self.assertIn(7, self.index.candidates(sequences, 10).tolist())
+
+    def test_save_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(tmp_dir, 'index.npz')
+            self.index.save(file_path)
+            loaded = KmerIndex.load(file_path)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual((loaded.k, loaded.protein_count), (3, len(self.proteins)))
+        self.assertEqual(loaded.shared_kmers(self.queries[-1]).tolist(),
+                         self.index.shared_kmers(self.queries[-1]).tolist())
+
+    def test_recall(self):
+        sequences = [{'key': 'near', 'sequence': self.queries[-1]},
+                     {'key': 'far', 'sequence': self.queries[1]}]
+        protein_ids = [f'prot_{i}' for i in range(len(self.proteins))]
+        near_shared = int(self.index.shared_kmers(self.queries[-1])[7])
+        far_shared = int(self.index.shared_kmers(self.queries[1])[3])
+        rows = [['prot_7', 'near', '80.0'], ['prot_3', 'far', '60.0'],
+                ['prot_4', 'far', '10.0'], ['other_genome', 'near', '90.0']]
+        recall = self.index.recall(sequences, rows, protein_ids, min_bitscore=50)
+        self.assertEqual(list(recall), list(RECALL_THRESHOLDS))
+        for threshold, fraction in recall.items():
+            self.assertEqual(fraction, ((near_shared >= threshold) + (far_shared >= threshold)) / 2)
+        self.assertEqual(self.index.recall(sequences, rows, protein_ids, min_bitscore=100), {})
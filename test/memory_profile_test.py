@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from kb_reaction_gene_finder.core.memory_profile import MemoryProfiler
+
+
+class MemoryProfilerTest(unittest.TestCase):
+    """Tests the per-stage memory profile"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'memory_profile.txt')
+
+    def tearDown(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        profiler = MemoryProfiler()
+        profiler.start()
+        profiler.mark('stage')
+        profiler.write_summary(self.path)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_summary(self):
+        profiler = MemoryProfiler(enabled=True, top=3)
+        profiler.start()
+        kept = [bytearray(2**20) for _ in range(4)]
+        profiler.mark('allocate')
+        profiler.write_summary(self.path)
+        self.assertFalse(tracemalloc.is_tracing())
+        with open(self.path) as infile:
+            summary = infile.read()
+        lines = summary.splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:3]], ['start', 'allocate'])
+        self.assertGreaterEqual(float(lines[2].split()[1]), len(kept))
+        self.assertIn("Largest growth up to allocate:", summary)
+        self.assertIn(f"{os.path.basename(__file__)}:", summary)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from kb_reaction_gene_finder.core.pipeline import Prefetcher, ordered_map
+
+
+class PipelineTest(unittest.TestCase):
+    """Tests the ordering, bounds and shutdown of the pipeline stages"""
+
+    def test_prefetcher_order_and_depth(self):
+        produced = []
+
+        def produce():
+            for i in range(20):
+                produced.append(i)
+                yield i
+        prefetcher = Prefetcher(produce(), 3)
+        time.sleep(0.2)
+        # the producer runs ahead before anything is consumed, but no more than depth items
+        self.assertLessEqual(len(produced), 5)
+        self.assertGreaterEqual(len(produced), 3)
+        self.assertEqual(list(prefetcher), list(range(20)))
+
+    def test_prefetcher_error(self):
+        def produce():
+            yield 1
+            yield 2
+            raise ValueError("RE failed")
+        results = []
+        with self.assertRaisesRegex(ValueError, "RE failed"):
+            for item in Prefetcher(produce(), 5):
+                results.append(item)
+        self.assertEqual(results, [1, 2])
+
+    def test_prefetcher_close(self):
+        prefetcher = Prefetcher(iter(range(1000)), 2)
+        for item in prefetcher:
+            if item == 3:
+                break
+        prefetcher._thread.join(1)
+        self.assertFalse(prefetcher._thread.is_alive())
+
+        unconsumed = Prefetcher(iter(range(1000)), 2)
+        unconsumed.close()
+        unconsumed._thread.join(1)
+        self.assertFalse(unconsumed._thread.is_alive())
+
+    def test_ordered_map(self):
+        rng = random.Random(0)
+        delays = [rng.uniform(0, 0.02) for _ in range(40)]
+        lock = threading.Lock()
+        in_flight, most_in_flight = [0], [0]
+
+        def work(i):
+            with lock:
+                in_flight[0] += 1
+                most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+            time.sleep(delays[i])
+            with lock:
+                in_flight[0] -= 1
+            return i * i
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(ordered_map(executor, work, range(40), 4)),
+                             [i * i for i in range(40)])
+        self.assertLessEqual(most_in_flight[0], 4)
+
+    def test_ordered_map_consumes_lazily(self):
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+        with ThreadPoolExecutor(2) as executor:
+            results = ordered_map(executor, lambda i: i, items(), 3)
+            self.assertEqual([next(results) for _ in range(2)], [0, 1])
+            self.assertLessEqual(len(consumed), 5)
+            results.close()
+
+    def test_ordered_map_cancels_pending(self):
+        started = []
+        release = threading.Event()
+
+        def work(i):
+            started.append(i)
+            if i:
+                release.wait(5)
+            return i
+        with ThreadPoolExecutor(1) as executor:
+            results = ordered_map(executor, work, range(10), 5)
+            self.assertEqual(next(results), 0)
+            results.close()
+            release.set()
+        # the calls still queued when the consumer stopped never ran
+        self.assertEqual(started[:1], [0])
+        self.assertLessEqual(len(started), 2)
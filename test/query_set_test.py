@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from kb_reaction_gene_finder.core import hit_table
+from kb_reaction_gene_finder.core.query_set import QuerySet, sequence_hash
+
+
+class QuerySetTest(unittest.TestCase):
+    """Tests collapsing identical sequences and fanning their hits back out"""
+
+    def test_dedup(self):
+        query_set = QuerySet()
+        first = query_set.add([{'key': 'a', 'sequence': 'MKV'},
+                               {'key': 'b', 'sequence': 'MKL'},
+                               {'key': 'c', 'sequence': None},
+                               {'key': 'd', 'sequence': ''}])
+        second = query_set.add([{'key': 'e', 'sequence': 'MKL'}, {'key': 'a', 'sequence': 'MKV'}])
+        self.assertEqual(first, [('a', sequence_hash('MKV')), ('b', sequence_hash('MKL'))])
+        self.assertEqual(second, [('e', sequence_hash('MKL')), ('a', sequence_hash('MKV'))])
+        self.assertEqual((len(query_set), query_set.gene_count), (2, 4))
+        self.assertEqual(query_set.records(),
+                         [{'key': sequence_hash('MKV'), 'sequence': 'MKV'},
+                          {'key': sequence_hash('MKL'), 'sequence': 'MKL'}])
+        self.assertFalse(QuerySet())
+
+    def test_fan_out(self):
+        genes = [{'key': 'a', 'sequence': 'MKV'}, {'key': 'b', 'sequence': 'MKL'},
+                 {'key': 'c', 'sequence': 'MKV'}]
+        query_set = QuerySet()
+        gene_hashes = query_set.add(genes)
+        # rows for the unique sequences, as an aligner would return them
+        rows = [['g1', sequence_hash('MKV'), '80', '90', '100', '1', '1e-10'],
+                ['g2', sequence_hash('MKL'), '60', '90', '100', '1', '1e-10']]
+        fanned = hit_table.fan_out(hit_table.from_rows(rows), gene_hashes)
+        # every gene gets its sequence's rows, in the order searching the genes would give
+        self.assertEqual(list(zip(fanned['sseqid'].tolist(), fanned['qseqid'].tolist())),
+                         [('g1', 'a'), ('g2', 'b'), ('g1', 'c')])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from kb_reaction_gene_finder.core.re_api import CircuitBreaker, RE_API
+from kb_reaction_gene_finder.core.re_cache import RECache
+from kb_reaction_gene_finder.core.sequence_store import SequenceStore
+from kb_reaction_gene_finder.core.timings import Timings
+from re_stub_server import StubREServer
+
+
+class RE_APITest(unittest.TestCase):
+    """Tests the relation engine client against a local stand-in for the RE API"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_related_sequences(self):
+        with StubREServer() as server:
+            re_api = RE_API(server.url, 'token')
+            results = re_api.get_related_sequences('rxn00010', 0.2, 0.2)
+            self.assertEqual(results, server.related_sequences('rxn00010', 0.2, 0.2))
+            self.assertTrue(results['genes'])
+
+    def test_batch_matches_single(self):
+        rids = ['rxn00010', 'rxn14379', 'rxn00371']
+        with StubREServer() as server:
+            re_api = RE_API(server.url, 'token')
+            batch = re_api.get_related_sequences_batch(rids, 0.3, 0.3)
+            self.assertEqual(server.request_count, 1)
+            for rid, results in zip(rids, batch):
+                expected = server.related_sequences(rid, 0.3, 0.3)
+                self.assertEqual(results['rxns'], expected['rxns'])
+                self.assertEqual(results['rxn_gene_links'], expected['rxn_gene_links'])
+                self.assertEqual(results['genes'], expected['genes'])
+
+    def test_concurrent_fetch(self):
+        rids = [f'rxn{i:05}' for i in range(10)]
+        with StubREServer(latency=0.2) as server:
+            re_api = RE_API(server.url, 'token')
+            start = time.time()
+            with ThreadPoolExecutor(10) as executor:
+                results = list(executor.map(re_api.get_related_sequences, rids))
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(results, [server.related_sequences(rid) for rid in rids])
+
+    def test_retries_and_circuit_breaker(self):
+        with StubREServer(error_rate=1) as server:
+            re_api = RE_API(server.url, 'token', retries=2, backoff=0.01,
+                            breaker=CircuitBreaker(5, 60))
+            with self.assertRaisesRegex(RuntimeError, "failed after 3 attempts"):
+                re_api.get_related_sequences('rxn00010')
+            # the breaker opens on the fifth failure, during the second call's retries
+            for _ in range(2):
+                with self.assertRaisesRegex(RuntimeError, "not retrying"):
+                    re_api.get_related_sequences('rxn00010')
+            self.assertEqual(server.request_count, 5)
+
+    def test_cache_narrows_higher_floors(self):
+        with StubREServer() as server:
+            re_api = RE_API(server.url, 'token',
+                            cache=RECache(os.path.join(self.tmp_dir, 're'), 3600))
+            re_api.get_related_sequences('rxn00010', 0, 0)
+            results = re_api.get_related_sequences('rxn00010', 0.5, 0.4)
+            self.assertEqual(server.request_count, 1)
+            self.assertEqual(results, server.related_sequences('rxn00010', 0.5, 0.4))
+
+    def test_two_phase(self):
+        with StubREServer() as server:
+            re_api = RE_API(server.url, 'token', sequence_store=SequenceStore(
+                os.path.join(self.tmp_dir, 'sequences')))
+            results = re_api.get_related_sequences_batch(['rxn00010'], 0, 0)[0]
+            self.assertEqual(results['genes'], server.related_sequences('rxn00010', 0, 0)['genes'])
+            self.assertEqual(server.request_count, 2)
+            re_api.get_related_sequences_batch(['rxn00010'], 0.5, 0.5)
+            self.assertEqual(server.request_count, 3)
+            # single reactions always use the stored view
+            re_api.get_related_sequences('rxn00010', 0, 0)
+            self.assertEqual(server.request_count, 4)
+
+    def test_absent_sequences_not_stored(self):
+        store = SequenceStore(os.path.join(self.tmp_dir, 'sequences'))
+        with StubREServer(absent_genes={'gene_2'}) as server:
+            re_api = RE_API(server.url, 'token', sequence_store=store)
+            self.assertEqual(re_api.get_gene_sequences(['gene_1', 'gene_2']),
+                             {'gene_1': server.gene('gene_1')['sequence']})
+            genes = [{'key': 'gene_1'}, {'key': 'gene_2'}]
+            re_api._add_sequences(genes)
+            self.assertIsNone(genes[1]['sequence'])
+            self.assertEqual(set(store.get(['gene_1', 'gene_2'])), {'gene_1'})
+            # the absent gene is asked for again rather than remembered as missing
+            re_api._add_sequences([{'key': 'gene_1'}, {'key': 'gene_2'}])
+            self.assertEqual(server.request_count, 3)
+
+    def test_timings(self):
+        timings = Timings()
+        with StubREServer() as server:
+            re_api = RE_API(server.url, 'token', timings=timings,
+                            cache=RECache(os.path.join(self.tmp_dir, 're'), 3600))
+            re_api.get_related_sequences_batch(['rxn00010', 'rxn14379'], 0, 0)
+            re_api.get_related_sequences('rxn00010', 0, 0)
+        recorded = timings.as_dict()
+        self.assertEqual(recorded['stage_calls'], {'re_query': 1})
+        self.assertEqual(recorded['counts']['re_queries'], 1)
+        self.assertEqual(recorded['counts']['re_retries'], 0)
+        self.assertEqual(recorded['counts']['re_cache_hits'], 1)
+        self.assertGreater(recorded['counts']['re_bytes'], 0)
+
+    def test_fixture_replay(self):
+        recorded = {'rxns': [{'id': 'rxn_reaction/rxn00010', 'key': 'rxn00010',
+                              'structural similarity': None, 'difference similarity': None},
+                             {'id': 'rxn_reaction/rxn00011', 'key': 'rxn00011',
+                              'structural similarity': 0.4, 'difference similarity': 0.9}],
+                    'rxn_gene_links': [{'rxn_id': 'rxn_reaction/rxn00011',
+                                        'linked_gene_ids': ['gene_a']}],
+                    'genes': [{'key': 'gene_a', 'product': '', 'function': '',
+                               'sequence': 'MKV'}]}
+        with open(os.path.join(self.tmp_dir, 'rxn00010.json'), 'w') as outfile:
+            json.dump({'sf_sim': 0, 'df_sim': 0, 'results': recorded}, outfile)
+        with StubREServer(fixture_dir=self.tmp_dir) as server:
+            re_api = RE_API(server.url, 'token')
+            self.assertEqual(re_api.get_related_sequences('rxn00010', 0.3, 0.3)['genes'],
+                             recorded['genes'])
+            self.assertEqual(re_api.get_related_sequences('rxn00010', 0.5, 0.5)['genes'], [])
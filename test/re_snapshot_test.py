@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_reaction_gene_finder.core.re_api import RE_API
+from kb_reaction_gene_finder.core.re_snapshot import LocalRE, export_snapshot
+from re_stub_server import StubREServer
+
+RIDS = ['rxn00010', 'rxn14379', 'rxn00371']
+
+
+class LocalRETest(unittest.TestCase):
+    """Tests that a snapshot answers queries as the relation engine does"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.tmp_dir, 're.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_page_collection(self):
+        with StubREServer(snapshot_reactions=RIDS) as server:
+            pages = list(RE_API(server.url, 'token').page_collection(
+                'rxn_reaction', '{key: d._key}', page_size=4))
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 4, 2])
+        self.assertEqual([doc['key'] for page in pages for doc in page],
+                         [doc['key'] for doc in server.collection_documents('rxn_reaction')])
+
+    def test_matches_re(self):
+        with StubREServer(snapshot_reactions=RIDS, absent_genes={'gene_64'}) as server:
+            re_api = RE_API(server.url, 'token')
+            export_snapshot(re_api, self.snapshot_path, page_size=7)
+            local_re = LocalRE(self.snapshot_path)
+            for rid in RIDS:
+                for floors in ((0, 0), (0.3, 0.5), (1, 1)):
+                    for exclude_self in (False, True):
+                        self.assertEqual(
+                            local_re.get_related_sequences(rid, *floors, exclude_self),
+                            re_api.get_related_sequences(rid, *floors, exclude_self))
+            # links come in rxn_id order, as the traversal's COLLECT returns them, not in the
+            # order the reactions were found
+            results = local_re.get_related_sequences(RIDS[1], 0, 0)
+            link_ids = [links['rxn_id'] for links in results['rxn_gene_links']]
+            self.assertEqual(link_ids, sorted(link_ids))
+            self.assertNotEqual(link_ids, [rxn['id'] for rxn in results['rxns']])
+            keys = [gene['key'] for gene in server.collection_documents('ncbi_gene')[:3]]
+            keys.append('gene_64')
+            self.assertEqual(local_re.get_gene_sequences(keys), re_api.get_gene_sequences(keys))
+        self.assertFalse([name for name in os.listdir(self.tmp_dir) if '.tmp-' in name])
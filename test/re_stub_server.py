@@ -0,0 +1,259 @@
+"""Local stand-in for the relation engine API, for benchmarking and testing the RE path
+
+Serves /api/v1/query_results/ for the list_genes_for_similar_reactions view and the ad-hoc
+queries RE_API makes, from recorded fixtures or deterministic synthetic data, with injectable
+latency, errors and payload size. Run it with
+
+    PYTHONPATH=lib python test/re_stub_server.py --port 8000 --latency 0.2 --error-rate 0.05
+
+and point re-api in deploy.cfg at http://localhost:8000.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from kb_reaction_gene_finder.core.re_cache import narrow_results
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def record_fixtures(re_api, rids, fixture_dir, sf_sim=0, df_sim=0):
+    """Saves live RE results for reactions as fixtures, at floors low enough to narrow later"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    for rid in rids:
+        results = re_api.get_related_sequences(rid, sf_sim, df_sim)
+        with open(os.path.join(fixture_dir, f"{rid.split('/')[-1]}.json"), 'w') as outfile:
+            json.dump({'sf_sim': sf_sim, 'df_sim': df_sim, 'results': results}, outfile)
+
+
+class StubREServer:
+    """Serves relation engine query results on a local port in a background thread
+
+    Reactions with a fixture in fixture_dir are answered from it, the others with synthetic
+    results of similar_reactions neighbors with genes_per_reaction genes each, drawn from a
+    pool of gene_pool genes of sequence_length residues so that reactions share genes. Every
+    request waits latency seconds plus up to jitter more and fails with probability
+    error_rate. Genes in absent_genes have no ncbi_gene document.
+
+    The collections paged through by RE_API.page_collection hold the synthetic neighborhoods
+    of the reactions in snapshot_reactions, the same documents the view results are built from.
+    """
+    def __init__(self, fixture_dir=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 similar_reactions=5, genes_per_reaction=20, gene_pool=500, sequence_length=300,
+                 seed=0, port=0, absent_genes=(), snapshot_reactions=()):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.similar_reactions = similar_reactions
+        self.genes_per_reaction = genes_per_reaction
+        self.gene_pool = gene_pool
+        self.sequence_length = sequence_length
+        self.seed = seed
+        self.absent_genes = set(absent_genes)
+        self.snapshot_reactions = list(snapshot_reactions)
+        self.request_count = 0
+        self.error_count = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def gene(self, key):
+        rng = random.Random(f'{self.seed}:{key}')
+        return {'key': key,
+                'product': f'synthetic protein {key}',
+                'function': f'synthetic function {rng.randrange(100)}',
+                'sequence': ''.join(rng.choice(AMINO_ACIDS)
+                                    for _ in range(self.sequence_length))}
+
+    def related_sequences(self, rid, sf_sim=1, df_sim=1, exclude_self=False):
+        """Returns the results the list_genes_for_similar_reactions view would for a reaction"""
+        if not rid.startswith('rxn_reaction/'):
+            rid = 'rxn_reaction/' + rid
+        key = rid.split('/')[1]
+        fixture = self.fixture_dir and os.path.join(self.fixture_dir, f'{key}.json')
+        if fixture and os.path.exists(fixture):
+            with open(fixture) as infile:
+                recorded = json.load(infile)
+            results = recorded['results']
+            if exclude_self:
+                results = dict(results, rxns=[rxn for rxn in results['rxns']
+                                              if rxn['id'] != rid])
+            return narrow_results(results, sf_sim, df_sim)
+
+        rng = random.Random(f'{self.seed}:{rid}')
+        rxns = [] if exclude_self else [
+            {'id': rid, 'key': key, 'name': f'synthetic reaction {key}', 'definition': key,
+             'structural similarity': None, 'difference similarity': None}]
+        # numbered like ModelSEED reactions, so they don't sort in the order they're found
+        for number in rng.sample(range(100000), self.similar_reactions):
+            rxn_key = f'rxn{number:05}_similar_to_{key}'
+            rxn = {'id': f'rxn_reaction/{rxn_key}', 'key': rxn_key,
+                   'name': f'synthetic reaction {rxn_key}', 'definition': rxn_key,
+                   'structural similarity': round(rng.random(), 3),
+                   'difference similarity': round(rng.random(), 3)}
+            if rxn['structural similarity'] >= sf_sim and rxn['difference similarity'] >= df_sim:
+                rxns.append(rxn)
+        rxn_gene_links = []
+        # RE collects the links by rxn_id, which sorts them
+        for rxn in sorted(rxns, key=lambda rxn: rxn['id']):
+            gene_rng = random.Random(f"{self.seed}:{rxn['id']}")
+            rxn_gene_links.append({'rxn_id': rxn['id'], 'linked_gene_ids': list(dict.fromkeys(
+                f'gene_{gene_rng.randrange(self.gene_pool)}'
+                for _ in range(self.genes_per_reaction)))})
+        gene_ids = dict.fromkeys(gene for links in rxn_gene_links
+                                 for gene in links['linked_gene_ids'])
+        return {'rxns': rxns, 'rxn_gene_links': rxn_gene_links,
+                'genes': [self.gene(gene) for gene in sorted(gene_ids)
+                          if gene not in self.absent_genes],
+                'missing_genes': [gene for gene in gene_ids if gene in self.absent_genes]}
+
+    def batch_results(self, rids, sf_sim, df_sim, exclude_self, with_sequences):
+        """Returns the results RE_API's batched ad-hoc query would for a list of reactions"""
+        reactions, genes = [], {}
+        for rid in rids:
+            results = self.related_sequences(rid, sf_sim, df_sim, exclude_self)
+            reactions.append({'rid': rid, 'rxns': results['rxns'],
+                              'rxn_gene_links': results['rxn_gene_links']})
+            for gene in results['genes']:
+                genes[gene['key']] = dict(gene, sequence=gene['sequence']
+                                          if with_sequences else None)
+        # RE returns genes in collection order, which sorting by key stands in for
+        return {'reactions': reactions, 'genes': [genes[key] for key in sorted(genes)]}
+
+    def collection_documents(self, collection):
+        """Returns the documents of a collection, as exported by re_snapshot, in key order"""
+        docs = {}
+        for rid in self.snapshot_reactions:
+            results = self.related_sequences(rid, 0, 0)
+            rid = results['rxns'][0]['id']
+            for i, rxn in enumerate(results['rxns']):
+                if collection == 'rxn_reaction':
+                    docs[rxn['key']] = {field: rxn[field]
+                                        for field in ('key', 'id', 'name', 'definition')}
+                elif collection == 'rxn_similar_to_reaction' and rxn['id'] != rid:
+                    # keyed in the order the view lists the reactions
+                    key = f"{rid.split('/')[1]}-{i:03}"
+                    docs[key] = {'key': key, 'from': rid, 'to': rxn['id'],
+                                 'sf_sim': rxn['structural similarity'],
+                                 'df_sim': rxn['difference similarity']}
+            for links in results['rxn_gene_links']:
+                complex_key = f"{links['rxn_id'].split('/')[1]}_complex"
+                if collection == 'rxn_reaction_within_complex':
+                    docs[complex_key] = {'key': complex_key, 'from': links['rxn_id'],
+                                         'to': f'rxn_gene_complex/{complex_key}'}
+                elif collection == 'rxn_gene_complex':
+                    docs[complex_key] = {'key': complex_key,
+                                         'id': f'rxn_gene_complex/{complex_key}',
+                                         'genes': links['linked_gene_ids']}
+            if collection == 'ncbi_gene':
+                docs.update((gene['key'], gene) for gene in results['genes'])
+        return [docs[key] for key in sorted(docs)]
+
+    def query(self, view, body):
+        """Returns the results list for a query, as RE would"""
+        floors = (body.get('sf_sim', 1), body.get('df_sim', 1), body.get('exclude_self', False))
+        if view == 'list_genes_for_similar_reactions' or 'rid' in body:
+            return [self.related_sequences(body['rid'], *floors)]
+        if 'rids' in body:
+            return [self.batch_results(body['rids'], *floors, body.get('with_sequences', True))]
+        if 'last_key' in body:
+            collection = re.search(r'FOR d IN (\w+)', body['query']).group(1)
+            return [doc for doc in self.collection_documents(collection)
+                    if doc['key'] > body['last_key']][:body['count']]
+        if 'keys' in body:
+            return [[{'key': key, 'sequence': self.gene(key)['sequence']}
+                     for key in body['keys'] if key not in self.absent_genes]]
+        raise ValueError("Unsupported query")
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or '{}')
+                with server._lock:
+                    server.request_count += 1
+                    delay = server.latency + server._random.uniform(0, server.jitter)
+                    fail = server._random.random() < server.error_rate
+                    if fail:
+                        server.error_count += 1
+                time.sleep(delay)
+                if url.path.rstrip('/') != '/api/v1/query_results':
+                    self._send(404, {'error': f'Unknown endpoint {url.path}'})
+                elif fail:
+                    self._send(500, {'error': 'Injected error',
+                                     'arango_message': 'The stub server failed on purpose'})
+                else:
+                    try:
+                        results = server.query(parse_qs(url.query).get('view', [None])[0], body)
+                    except (KeyError, ValueError) as error:
+                        self._send(400, {'error': str(error)})
+                    else:
+                        self._send(200, {'results': results, 'count': len(results)})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fixtures', help="directory of recorded <reaction>.json results")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="maximum random seconds added to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests that fail")
+    parser.add_argument('--genes', type=int, default=20, help="genes per synthetic reaction")
+    parser.add_argument('--sequence-length', type=int, default=300,
+                        help="residues per synthetic gene")
+    args = parser.parse_args()
+    server = StubREServer(args.fixtures, args.latency, args.jitter, args.error_rate,
+                          genes_per_reaction=args.genes, sequence_length=args.sequence_length,
+                          port=args.port)
+    print(f"Serving relation engine stand-in at {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from kb_reaction_gene_finder.core.app_impl import _make_timings_html
+from kb_reaction_gene_finder.core.timings import Timings
+
+
+class TimingsTest(unittest.TestCase):
+    """Tests recording a run's timings and counts and their report section"""
+
+    def test_as_dict(self):
+        timings = Timings()
+        with timings.span('alignment', 'rxn00010'):
+            pass
+        timings.add('alignment', 1.5)
+        timings.count('alignment_rows', 3, 'rxn00010')
+        timings.count('re_queries')
+        recorded = timings.as_dict()
+        self.assertEqual(recorded['stage_calls'], {'alignment': 2})
+        self.assertGreaterEqual(recorded['stage_seconds']['alignment'], 1.5)
+        self.assertEqual(recorded['counts'], {'alignment_rows': 3, 're_queries': 1})
+        self.assertEqual([(reaction['reaction_id'], list(reaction['stage_seconds']),
+                           reaction['counts']) for reaction in recorded['reactions']],
+                         [('rxn00010', ['alignment'], {'alignment_rows': 3})])
+
+    def test_span_records_failures(self):
+        timings = Timings()
+        with self.assertRaises(ValueError):
+            with timings.span('re_fetch'):
+                raise ValueError()
+        self.assertEqual(timings.as_dict()['stage_calls'], {'re_fetch': 1})
+
+    def test_exclusive_span(self):
+        timings = Timings()
+        with timings.span('alignment', 'rxn00010'):
+            with timings.span('genome_index', exclusive=True):
+                time.sleep(0.2)
+            with timings.span('ranking', 'rxn00010'):
+                pass
+        recorded = timings.as_dict()
+        self.assertGreaterEqual(recorded['stage_seconds']['genome_index'], 0.2)
+        self.assertLess(recorded['stage_seconds']['alignment'], 0.1)
+        self.assertEqual(sorted(recorded['reactions'][0]['stage_seconds']),
+                         ['alignment', 'ranking'])
+
+    def test_threads(self):
+        timings = Timings()
+
+        def record(i):
+            for _ in range(200):
+                timings.add('alignment', 0.001, f'rxn{i % 4}')
+                timings.count('alignment_rows', 2, f'rxn{i % 4}')
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(record, range(8)))
+        recorded = timings.as_dict()
+        self.assertEqual(recorded['stage_calls']['alignment'], 1600)
+        self.assertEqual(recorded['counts']['alignment_rows'], 3200)
+        self.assertEqual([reaction['counts']['alignment_rows']
+                          for reaction in recorded['reactions']], [800] * 4)
+
+    def test_html(self):
+        timings = Timings()
+        timings.add('alignment', 0.25, 'rxn00010')
+        timings.count('re_genes', 7, 'rxn00010')
+        html = _make_timings_html(timings.as_dict())
+        self.assertIn('<tr><td>alignment</td><td>0.25</td><td>1</td></tr>', html)
+        self.assertIn('<tr><td>rxn00010</td><td>0.25</td><td>7</td></tr>', html)
+        self.assertIn('total run time are not included', html)